@@ -0,0 +1,210 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#############################################################################
+#    Memory-bounded analytics over the loan history.
+#    The history (archive segments written by compact_history() + the live
+#    file) is streamed in chunks with explicit dtypes. The chunk size is
+#    derived from a memory cap per chunk, so memory doesn't grow with the
+#    number of rows. Only per-loan state (not per-row) is carried from chunk
+#    to chunk. It comes on top of the cap and grows with the number of loans.
+#
+#    Usage:  python analytics.py [path/to/yield_hist_loan_activity.csv]
+#############################################################################
+
+import os, sys
+import pandas as pd
+
+from storage import archive_segments
+
+
+csv_hist_loans = 'yield_hist_loan_activity.csv'
+
+# Explicit dtypes of the history columns. uint256 amounts don't fit int64.
+HIST_DTYPES = {
+    'id': 'int64', 'time': 'object', 'loan_address': 'object',
+    'loan_status': 'int8', 'is_defaulted': 'bool', 'address_borrower': 'object',
+    'principal': 'float64', 'collateral': 'float64', 'interest': 'float64',
+    'ts_start': 'int64', 'ts_due': 'int64', 'duration': 'int64', 'ts_repaid': 'int64',
+    'collateral_balance': 'float64', 'address_lender': 'object',
+    'liquidatable_t_allowance': 'int64', 'address_lending_token': 'object',
+    'address_collateral_token': 'object'
+    }
+
+# Default peak memory for a chunk of parsed rows (bytes). Per chunk: State
+# carried between chunks (one entry per loan) isn't counted against it.
+MAX_MEMORY = 64 * 1024**2
+
+# Rows read to estimate the memory needed per row
+PROBE_ROWS = 1000
+
+# pandas needs a multiple of the final DataFrame's size while parsing
+PARSE_OVERHEAD = 4
+
+
+# Helper function: Files holding the full history, oldest first
+def history_files(csv_hist_loans=csv_hist_loans):
+    files = archive_segments(csv_hist_loans)
+    if os.path.isfile(csv_hist_loans):
+        files.append(csv_hist_loans)
+    return files
+
+
+# Helper function: Rows per chunk so that a parsed chunk stays below max_memory
+def chunk_rows(fileName, usecols=None, max_memory=MAX_MEMORY):
+    dtypes = {k: v for k, v in HIST_DTYPES.items() if not usecols or k in usecols}
+    probe = pd.read_csv(fileName, nrows=PROBE_ROWS, usecols=usecols, dtype=dtypes)
+    if probe.empty:
+        return PROBE_ROWS
+
+    bytes_per_row = probe.memory_usage(deep=True).sum() / len(probe)
+    return max(1, int(max_memory // (bytes_per_row * PARSE_OVERHEAD)))
+
+
+# Streams the whole history in chronological order, one DataFrame chunk at a time
+def iter_history(csv_hist_loans=csv_hist_loans, usecols=None, max_memory=MAX_MEMORY):
+    '''
+    Yields DataFrames of at most as many rows as fit in max_memory (bytes).
+    The estimate per row comes from the first PROBE_ROWS rows of each file.
+    Reads archive segments (compressed) first, then the live file.
+    usecols: Only parse these columns (saves memory and time).
+    '''
+    dtypes = {k: v for k, v in HIST_DTYPES.items() if not usecols or k in usecols}
+
+    for fileName in history_files(csv_hist_loans):
+        chunksize = chunk_rows(fileName, usecols=usecols, max_memory=max_memory)
+        with pd.read_csv(fileName, usecols=usecols, dtype=dtypes,
+                         chunksize=chunksize) as reader:
+            for chunk in reader:
+                if not chunk.empty:
+                    yield chunk
+
+
+# Helper function: Month ('2021-02') of every value of the 'time' column
+def to_month(times):
+    return pd.to_datetime(times, format='%Y %b %d %H:%M').dt.strftime('%Y-%m')
+
+
+# Total principal lent per lending token (raw token units), each loan counted once
+def token_volume(csv_hist_loans=csv_hist_loans, max_memory=MAX_MEMORY):
+    usecols = ['loan_address', 'principal', 'address_lending_token']
+    seen = set()
+    volume = pd.Series(dtype='float64')
+
+    for chunk in iter_history(csv_hist_loans, usecols=usecols, max_memory=max_memory):
+        first = chunk.drop_duplicates('loan_address')
+        first = first[~first['loan_address'].isin(seen)]
+        seen.update(first['loan_address'])
+
+        chunk_volume = first.groupby('address_lending_token')['principal'].sum()
+        volume = volume.add(chunk_volume, fill_value=0)
+
+    volume.index.name = 'address_lending_token'
+    return volume.rename('principal').sort_index()
+
+
+# Principal of currently active loans per borrower (raw token units, per token)
+def borrower_exposure(csv_hist_loans=csv_hist_loans, max_memory=MAX_MEMORY):
+    '''
+    Uses the latest row of every loan. Returns a Series indexed by
+    (address_borrower, address_lending_token). Carries the latest row of
+    every loan between chunks (memory on top of max_memory).
+    '''
+    usecols = ['id', 'loan_address', 'loan_status', 'address_borrower',
+               'principal', 'address_lending_token']
+    latest = None
+
+    # Carry only the latest row per loan from chunk to chunk
+    for chunk in iter_history(csv_hist_loans, usecols=usecols, max_memory=max_memory):
+        frames = [chunk] if latest is None else [latest, chunk]
+        latest = pd.concat(frames).groupby('loan_address').tail(1)
+
+    if latest is None:
+        return pd.Series(dtype='float64', name='principal')
+
+    active = latest[latest['loan_status'] == 0]
+    exposure = active.groupby(['address_borrower', 'address_lending_token'])['principal'].sum()
+    return exposure.sort_index()
+
+
+# Number of status changes per month: (month, from_status, to_status) -> count
+def status_transitions(csv_hist_loans=csv_hist_loans, max_memory=MAX_MEMORY):
+    '''
+    Every row of the history is a transition of its loan. from_status of a
+    loan's first row is -1 (= new loan). Carries the last status of every
+    loan between chunks (memory on top of max_memory).
+    '''
+    usecols = ['time', 'loan_address', 'loan_status']
+    last_status = pd.Series(dtype='int8')
+    counts = None
+
+    for chunk in iter_history(csv_hist_loans, usecols=usecols, max_memory=max_memory):
+        # Previous status within chunk, else carried over from earlier chunks
+        previous = chunk.groupby('loan_address')['loan_status'].shift()
+        carried = chunk['loan_address'].map(last_status)
+        previous = previous.fillna(carried).fillna(-1).astype('int8')
+
+        transitions = pd.DataFrame({
+            'month': to_month(chunk['time']),
+            'from_status': previous,
+            'to_status': chunk['loan_status']})
+        chunk_counts = transitions.groupby(['month', 'from_status', 'to_status']).size()
+        counts = chunk_counts if counts is None else counts.add(chunk_counts, fill_value=0)
+
+        chunk_last = chunk.groupby('loan_address')['loan_status'].last()
+        last_status = chunk_last.combine_first(last_status)
+
+    if counts is None:
+        return pd.Series(dtype='int64', name='loans')
+
+    counts.index.names = ['month', 'from_status', 'to_status']
+    return counts.astype('int64').rename('loans').sort_index()
+
+
+# Runs the same aggregations on the whole history in memory. Returns {name: equal?}
+def compare_with_pandas(csv_hist_loans=csv_hist_loans, max_memory=MAX_MEMORY):
+    '''
+    Reference check of the chunked aggregations against plain pandas on the
+    fully loaded history. Only use on histories that fit into memory.
+    '''
+    data = pd.concat([pd.read_csv(f, dtype=HIST_DTYPES)
+                      for f in history_files(csv_hist_loans)], ignore_index=True)
+
+    volume = data.drop_duplicates('loan_address') \
+        .groupby('address_lending_token')['principal'].sum().sort_index()
+
+    latest = data.groupby('loan_address').tail(1)
+    exposure = latest[latest['loan_status'] == 0] \
+        .groupby(['address_borrower', 'address_lending_token'])['principal'].sum().sort_index()
+
+    previous = data.groupby('loan_address')['loan_status'].shift().fillna(-1).astype('int8')
+    transitions = pd.DataFrame({
+        'month': to_month(data['time']),
+        'from_status': previous,
+        'to_status': data['loan_status']}) \
+        .groupby(['month', 'from_status', 'to_status']).size().sort_index()
+
+    return {
+        'token_volume': same(token_volume(csv_hist_loans, max_memory),
+                             volume.rename('principal')),
+        'borrower_exposure': same(borrower_exposure(csv_hist_loans, max_memory), exposure),
+        'status_transitions': same(status_transitions(csv_hist_loans, max_memory),
+                                   transitions.rename('loans'))
+        }
+
+
+# Helper function for compare_with_pandas(): Equal apart from float rounding?
+def same(chunked, in_memory):
+    try:
+        pd.testing.assert_series_equal(chunked, in_memory, check_dtype=False,
+                                       check_index_type=False, check_exact=False)
+        return True
+    except AssertionError:
+        return False
+
+
+if __name__ == '__main__':
+    fileName = sys.argv[1] if len(sys.argv) > 1 else csv_hist_loans
+    print('Volume per lending token:\n', token_volume(fileName), '\n')
+    print('Active exposure per borrower:\n', borrower_exposure(fileName), '\n')
+    print('Status transitions per month:\n', status_transitions(fileName))
@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#############################################################################
+#    Startup-time benchmark of the light subcommands of main.py.
+#    Runs each subcommand in a fresh interpreter (in an empty temp dir, so
+#    no network and no data files are involved) and reports the best of n
+#    wall-clock times. Fails if one of them isn't below LIMIT seconds.
+#
+#    Usage:  python bench_startup.py [n]
+#############################################################################
+
+import os, sys
+import shutil
+import subprocess
+import tempfile
+from time import perf_counter
+
+
+# Light subcommands and the upper limit for their startup time (s)
+LIGHT_COMMANDS = [['--help'], ['prices', '--show'], ['compact']]
+LIMIT = 1.0
+
+main_py = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'main.py')
+
+
+# Helper function: Best wall-clock time (s) of n runs of main.py with args
+def time_command(args, n=5, cwd=None):
+    times = []
+    for _ in range(n):
+        start = perf_counter()
+        subprocess.run([sys.executable, main_py] + args, cwd=cwd, check=True,
+                       stdout=subprocess.DEVNULL)
+        times.append(perf_counter() - start)
+    return min(times)
+
+
+def run(n=5):
+    tmp_dir = tempfile.mkdtemp()
+    results = {}
+
+    try:
+        for args in LIGHT_COMMANDS:
+            results[' '.join(args)] = time_command(args, n=n, cwd=tmp_dir)
+    finally:
+        shutil.rmtree(tmp_dir)
+
+    for command, seconds in results.items():
+        status = 'ok' if seconds < LIMIT else 'TOO SLOW'
+        print(f'main.py {command:<16} {seconds:6.3f} s   {status}')
+
+    return all(seconds < LIMIT for seconds in results.values())
+
+
+if __name__ == '__main__':
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    sys.exit(0 if run(n) else 1)
@@ -0,0 +1,254 @@
+#############################################################################
+#    Targeted extraction of token metrics from coingecko.com coin pages.
+#    The page is streamed through a small html.parser subclass once, which
+#    only keeps the few elements the metrics are read from and stops as soon
+#    as all of them have been seen. If coingecko changes their layout, the
+#    name of the field that couldn't be extracted is reported.
+#############################################################################
+
+import os, sys
+import urllib.request
+from html.parser import HTMLParser
+
+
+# Number of elements needed from the page (see extract_token_metrics())
+N_NO_WRAP = 14      # <span class="no-wrap">
+N_MT1 = 7           # <div class="mt-1">
+
+# Saved coin pages used by validate_fixtures() (see save_fixture())
+fixture_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+userAgent = 'Mozilla/5.0 (Windows NT 6.1) AppleWebKit/537.36 (KHTML, like Gecko)' + \
+    ' Chrome/41.0.2228.0 Safari/537.36'
+
+
+# Raised by extract_token_metrics() if a field can't be found / converted
+class ScrapeError(Exception):
+    def __init__(self, field, detail=''):
+        self.field = field
+        super().__init__(
+            f"Coingecko seems to have restructured their website. "
+            f"Couldn't scrape '{field}'. {detail}".strip())
+
+
+# Raised internally to abort parsing once all needed elements have been seen
+class _Done(Exception):
+    pass
+
+
+# One pass parser collecting only <span class="no-wrap">, <div class="mt-1"> and the 'Rank' row
+class CoinPageParser(HTMLParser):
+    '''
+    Feed html, then read:
+    no_wrap     list of (attrs dict, text) of the first N_NO_WRAP spans
+    mt1         list of texts of the first N_MT1 divs
+    rank_row    text of the first table row containing 'Rank' (or None)
+    Parsing stops once n_no_wrap spans, n_mt1 divs and (if rank) the row are found.
+    '''
+    def __init__(self, n_no_wrap=N_NO_WRAP, n_mt1=N_MT1, rank=True):
+        super().__init__(convert_charrefs=True)
+        self.n_no_wrap = n_no_wrap
+        self.n_mt1 = n_mt1
+        self.rank = rank
+        self.no_wrap = []
+        self.mt1 = []
+        self.rank_row = None
+        self._captures = []     # [tag, depth, kind, attrs, text parts]
+
+    def complete(self):
+        return len(self.no_wrap) >= self.n_no_wrap and len(self.mt1) >= self.n_mt1 \
+            and (self.rank_row is not None or not self.rank)
+
+    def handle_starttag(self, tag, attrs):
+        for capture in self._captures:
+            if capture[0] == tag:
+                capture[1] += 1
+
+        attrs = dict(attrs)
+        classes = (attrs.get('class') or '').split()
+
+        if tag == 'span' and 'no-wrap' in classes and len(self.no_wrap) < self.n_no_wrap:
+            self._captures.append([tag, 1, 'no_wrap', attrs, []])
+        elif tag == 'div' and 'mt-1' in classes and len(self.mt1) < self.n_mt1:
+            self._captures.append([tag, 1, 'mt1', attrs, []])
+        elif tag == 'tr' and self.rank and self.rank_row is None:
+            self._captures.append([tag, 1, 'tr', attrs, []])
+
+    def handle_data(self, data):
+        for capture in self._captures:
+            capture[4].append(data)
+
+    def handle_endtag(self, tag):
+        for capture in list(self._captures):
+            if capture[0] != tag:
+                continue
+            capture[1] -= 1
+            if capture[1] == 0:
+                self._captures.remove(capture)
+                self._finish(capture)
+
+        if not self._captures and self.complete():
+            raise _Done
+
+    def _finish(self, capture):
+        _, _, kind, attrs, parts = capture
+        text = ''.join(parts).strip()
+
+        if kind == 'no_wrap':
+            self.no_wrap.append((attrs, text))
+        elif kind == 'mt1':
+            self.mt1.append(text)
+        elif 'Rank' in text and self.rank_row is None:
+            self.rank_row = text
+
+
+# Helper function: Streams html (bytes or str) through CoinPageParser
+def parse_coin_page(html, **kwargs):
+    if isinstance(html, bytes):
+        html = html.decode('utf-8', 'replace')
+
+    parser = CoinPageParser(**kwargs)
+    try:
+        parser.feed(html)
+        parser.close()
+    except _Done:
+        pass
+
+    return parser
+
+
+# Helper function: Downloads a coin page from coingecko.com, returns raw bytes
+def fetch_coin_page(token_str):
+    '''
+    Assumes a string matching an existing html child of 'coingecko.com/en/coins/', i.e. 'ethereum'.
+    '''
+    url = 'https://www.coingecko.com/en/coins/' + token_str
+    req = urllib.request.Request(url, headers= {'User-Agent' : userAgent})
+    html = urllib.request.urlopen(req)
+    return html.read()
+
+
+# Helper function: Removes any '$', '%', and ',' from string and converts to float
+def to_float(field, string):
+    if string in {None, ''}:
+        raise ScrapeError(field, 'Value is empty.')
+    try:
+        return float(string.replace(',','').replace('$','').replace('%','').strip())
+    except ValueError:
+        raise ScrapeError(field, f"'{string}' is not a number.")
+
+
+# Helper functions for extract_token_metrics(): Get n-th element or fail with field name
+def _no_wrap(parser, field, i):
+    try:
+        return parser.no_wrap[i]
+    except IndexError:
+        raise ScrapeError(field, f'Only {len(parser.no_wrap)} <span class="no-wrap"> found.')
+
+def _mt1(parser, field, i):
+    try:
+        return parser.mt1[i]
+    except IndexError:
+        raise ScrapeError(field, f'Only {len(parser.mt1)} <div class="mt-1"> found.')
+
+
+# Extracts the dict of token metrics returned by functions.get_token_metrics()
+def extract_token_metrics(html):
+    '''
+    Takes the html of a coingecko coin page and returns a dict of metrics.
+    Raises ScrapeError naming the first field that couldn't be extracted.
+    '''
+    parser = parse_coin_page(html)
+    tokenDict = {}
+
+    # Spans: (field, index, attribute to read instead of text)
+    spanFields = [
+        ('priceUSD', 0, None), ('priceBTC', 0, 'data-price-btc'),
+        ('mcUSD', 1, None), ('mcBTC', 1, 'data-price-btc'),
+        ('24hVol', 2, None), ('24hLow', 3, None), ('24hHigh', 4, None),
+        ('7dLow', 10, None), ('7dHigh', 11, None),
+        ('ATH', 12, None), ('ATL', 13, None)
+        ]
+
+    for field, i, attr in spanFields:
+        attrs, text = _no_wrap(parser, field, i)
+        tokenDict[field] = to_float(field, attrs.get(attr) if attr else text)
+
+    # Market cap rank: All digits in the first table row containing 'Rank'
+    if parser.rank_row is None:
+        raise ScrapeError('mcRank', "No table row containing 'Rank' found.")
+    digits = ''.join(filter(lambda i: i.isdigit(), parser.rank_row))
+    if not digits:
+        raise ScrapeError('mcRank', f"'{parser.rank_row}' contains no digits.")
+    tokenDict['mcRank'] = int(digits)
+
+    # Supply: 'circulating / total'. Infinite total supply (as in ETH) becomes inf
+    supply = _mt1(parser, 'circSupply', 6).split('/')
+    tokenDict['circSupply'] = to_float('circSupply', supply[0])
+    try:
+        tokenDict['totalSupply'] = to_float('totalSupply', supply[1])
+    except (IndexError, ScrapeError):
+        tokenDict['totalSupply'] = float('inf')
+
+    symbol = _no_wrap(parser, 'symbol', 0)[0].get('data-coin-symbol')
+    if not symbol:
+        raise ScrapeError('symbol', "Attribute 'data-coin-symbol' missing.")
+    tokenDict['symbol'] = symbol
+
+    return tokenDict
+
+
+# Extracts only the current USD price from a coingecko coin page
+def extract_token_price(html):
+    parser = parse_coin_page(html, n_no_wrap=1, n_mt1=0, rank=False)
+    return to_float('priceUSD', _no_wrap(parser, 'priceUSD', 0)[1])
+
+
+# Saves a coin page as fixture for validate_fixtures()
+def save_fixture(token_str, fixture_dir=fixture_dir):
+    os.makedirs(fixture_dir, exist_ok=True)
+    path = os.path.join(fixture_dir, token_str + '.html')
+    with open(path, 'wb') as file:
+        file.write(fetch_coin_page(token_str))
+    return path
+
+
+# Runs extract_token_metrics() on every saved page in fixture_dir
+def validate_fixtures(fixture_dir=fixture_dir, verbose=True):
+    '''
+    Returns dict {file name: None if ok, else name of the field that failed}.
+    Use after saving fresh pages with save_fixture() to check the extraction
+    still works with coingecko's current layout. Empty dict if there are no
+    saved pages.
+    '''
+    results = {}
+
+    # Possibility: No pages saved yet. Nothing to validate.
+    if not os.path.isdir(fixture_dir):
+        if verbose:
+            print(f"No fixture directory '{fixture_dir}' found. "
+                  "Save coin pages with save_fixture() first.")
+        return results
+
+    for name in sorted(os.listdir(fixture_dir)):
+        if not name.endswith('.html'):
+            continue
+        with open(os.path.join(fixture_dir, name), 'rb') as file:
+            html = file.read()
+        try:
+            extract_token_metrics(html)
+            results[name] = None
+        except ScrapeError as e:
+            results[name] = e.field
+
+        if verbose:
+            status = 'ok' if results[name] is None else f"failed at '{results[name]}'"
+            print(f'{name}: {status}')
+
+    return results
+
+
+if __name__ == '__main__':
+    # Usage: python coingecko.py [fixture_dir]. Fails if nothing validated or a field failed.
+    results = validate_fixtures(*sys.argv[1:2])
+    sys.exit(not results or any(field is not None for field in results.values()))
@@ -1,14 +1,15 @@
 from lookups import *
 import os, inspect, sys
 import random
+import numpy as np
 import pandas as pd
-import urllib.request
-from bs4 import BeautifulSoup
 from time import sleep
 from datetime import datetime
 
-from etherscan import Etherscan
-from web3.auto.infura import w3
+import tokens
+from tokens import sync_token_registry, get_token_info, get_decimals
+from storage import apply_delta, get_index, save_index, read_tail, get_last_id, snapshot_path
+from coingecko import fetch_coin_page, extract_token_price, extract_token_metrics, ScrapeError
 
 logfile = 'yield_logging_TEST.txt'
 daily_log= 'yied_daily_log_TEST.txt'
@@ -20,20 +21,54 @@ daily_log= 'yied_daily_log_TEST.txt'
 #############################################################################
 
 
-# Initialize Etherscan API
-API_KEY = os.environ['ETHERSCAN_API_KEY']
-etherscan = Etherscan(API_KEY)
+# w3, eth, etherscan <- set by connect()
+w3 = None
+eth = None
+etherscan = None
 
-# Connect to ETH Node (Infura)
-eth = w3.eth
-
-# Contract addresses
+# Contract addresses (default deployment: yield.credit on mainnet)
 loan_address = '0xbFE28f2d7ade88008af64764eA16053F705CF1f0'
 loan_fac_address = '0x49aF18b1ecA40Ef89cE7F605638cF675B70012A7'
 
+
+# Connects to an ETH node and the Etherscan API. Infura (mainnet) by default.
+def connect(provider_url=None, etherscan_net='main'):
+    '''
+    Sets globals w3, eth, etherscan. Each worker process tracking another
+    deployment / network calls this with its own provider_url.
+    '''
+    global w3, eth, etherscan
+
+    # Connect to ETH Node (Infura if no provider specified)
+    if provider_url:
+        from web3 import Web3
+        w3 = Web3(Web3.HTTPProvider(provider_url))
+    else:
+        from web3.auto.infura import w3 as infura_w3
+        w3 = infura_w3
+    eth = w3.eth
+
+    # Initialize Etherscan API
+    from etherscan import Etherscan
+    API_KEY = os.environ['ETHERSCAN_API_KEY']
+    etherscan = Etherscan(API_KEY, net=etherscan_net)
+
+    return w3
+
+
 # TOKEN_METRICS_TODAY <- gets filled by update_daily_metrics()
 TOKEN_METRICS_TODAY = {}
 
+# PINNED_BLOCK <- block number all on-chain reads of a run are made at (pin_block())
+PINNED_BLOCK = 'latest'
+
+# RPC_CACHE <- {(block, contract address, method, args): value}, see cached_call()
+RPC_CACHE = {}
+
+# MULTICALL, MAINNET <- network settings of the token registry, set by load_loans()
+MULTICALL = multicall_address
+MAINNET = True
+
 
 #############################################################################
 #
@@ -42,7 +77,9 @@ TOKEN_METRICS_TODAY = {}
 #   ABI_LOAN_FAC    Abi for smart contract LoanFactory.sol
 #   ABI_LOAN        Abi for smart contract Loan.sol
 #   LOAN_FAC        Instantiated & queryable smart contract LoanFactory.sol
+#   ALL_LOANS       set of addresses of all loans ever taken out
 #   ALL_LOANS_DATA  dict of dicts: {loan_address_i: {metric_j: val_j, ...}}
+#   All of them are set by load_loans().
 #
 #############################################################################
 
@@ -55,9 +92,38 @@ def instantiate_contract(address, abi):
     contract = eth.contract(address=address, abi=abi)
     return contract
 
-ABI_LOAN_FAC = get_abi(loan_fac_address)
-ABI_LOAN = get_abi(loan_address)
 
+# Pins all following on-chain reads to one block (default: current block)
+def pin_block(block=None):
+    '''
+    All stages of a run then see one consistent snapshot of the chain,
+    no matter when during the run they query a value.
+    '''
+    global PINNED_BLOCK
+
+    block = block if block is not None else eth.block_number
+
+    # Values cached at another block will never be asked for again
+    if block != PINNED_BLOCK:
+        RPC_CACHE.clear()
+
+    PINNED_BLOCK = block
+    return PINNED_BLOCK
+
+
+# Calls a view function of a contract at PINNED_BLOCK. Each value is fetched only once.
+def cached_call(contract, method, *args):
+    '''
+    Memoizes results by (block, contract, method, args). Repeated calls in
+    the same run (i.e. get_loan_data() for the same loan) don't hit the node.
+    '''
+    key = (PINNED_BLOCK, contract.address, method, args)
+
+    if key not in RPC_CACHE:
+        function = getattr(contract.functions, method)
+        RPC_CACHE[key] = function(*args).call(block_identifier=PINNED_BLOCK)
+
+    return RPC_CACHE[key]
 
 # Appends a row (datetime + log message) to a logfile.
 def log(logfile, _str):
@@ -79,18 +145,6 @@ def log(logfile, _str):
 
 
 
-# ALL_LOANS <- addresses of all loans ever taken out
-LOAN_FAC = instantiate_contract(loan_fac_address, ABI_LOAN_FAC)
-
-try:
-    ALL_LOANS = set(LOAN_FAC.caller.getLoans())
-except:
-    message = "Couldn't query LoanFactory.sol. Aborted data collection."
-    print(message)
-    log(logfile, message)
-
-
-
 # Helper function: Takes token address and returns symbol as specified in token_map
 def get_token_symbol(token_address):
     try:
@@ -155,14 +209,13 @@ def get_loan_data(loan_address):
     d = {}
     # Instantiate contract to make it callable
     loan = eth.contract(address=loan_address, abi=ABI_LOAN)
-    caller = loan.caller()
 
-    # Get data
-    d['collateral_balance'] = caller.getCollateralBalance()
-    d['loan_details'] = caller.getLoanDetails()
-    d['meta_data'] = caller.getLoanMetadata()
-    d['ts_due'] = caller.getTimestampDue()
-    d['is_defaulted'] = caller.isDefaulted()
+    # Get data (at PINNED_BLOCK, each value fetched at most once per run)
+    d['collateral_balance'] = cached_call(loan, 'getCollateralBalance')
+    d['loan_details'] = cached_call(loan, 'getLoanDetails')
+    d['meta_data'] = cached_call(loan, 'getLoanMetadata')
+    d['ts_due'] = cached_call(loan, 'getTimestampDue')
+    d['is_defaulted'] = cached_call(loan, 'isDefaulted')
 
     # Extract nested data
     d = extract_loan_details(d)
@@ -171,7 +224,52 @@ def get_loan_data(loan_address):
     return d
 
 
-ALL_LOANS_DATA = {loan: get_loan_data(loan) for loan in ALL_LOANS}
+# Sets ABI_LOAN_FAC, ABI_LOAN, LOAN_FAC, ALL_LOANS, ALL_LOANS_DATA for 1 deployment
+def load_loans(loan_fac_address=loan_fac_address, loan_address=loan_address,
+               registry_path=None, logfile=logfile, multicall=multicall_address,
+               mainnet=True):
+    '''
+    Queries LoanFactory.sol for all loans ever taken out and gets their data.
+    Then resolves all tokens used in these loans in the token registry
+    (stored at registry_path). Expects connect() to have been called.
+    All reads are pinned to the block that is current when this is called.
+    multicall:  address of Multicall2 on this network (None if there is none)
+    mainnet:    whether the tokens in token_map (mainnet addresses) exist here
+    '''
+    global ABI_LOAN_FAC, ABI_LOAN, LOAN_FAC, ALL_LOANS, ALL_LOANS_DATA, MULTICALL, MAINNET
+
+    MULTICALL, MAINNET = multicall, mainnet
+
+    pin_block()
+    print(f'Reading loan data as of block {PINNED_BLOCK}...')
+
+    ABI_LOAN_FAC = get_abi(loan_fac_address)
+    ABI_LOAN = get_abi(loan_address)
+
+    # ALL_LOANS <- addresses of all loans ever taken out
+    LOAN_FAC = instantiate_contract(loan_fac_address, ABI_LOAN_FAC)
+
+    try:
+        ALL_LOANS = set(cached_call(LOAN_FAC, 'getLoans'))
+    except:
+        message = "Couldn't query LoanFactory.sol. Aborted data collection."
+        print(message)
+        log(logfile, message)
+        raise
+
+    ALL_LOANS_DATA = {loan: get_loan_data(loan) for loan in ALL_LOANS}
+
+    # TOKEN_REGISTRY <- decimals, symbol, supply of all tokens (1 batched query)
+    if registry_path:
+        tokens.registry_file = registry_path
+        tokens.load_token_registry()
+
+    loan_tokens = {v[key] for v in ALL_LOANS_DATA.values()
+                   for key in ('address_lending_token', 'address_collateral_token')}
+    sync_token_registry(w3, loan_tokens, block_identifier=PINNED_BLOCK,
+                        multicall=MULTICALL, mainnet=MAINNET)
+
+    return ALL_LOANS_DATA
 
 
 # Helper function for appendToCsv(): Appends a new row to csv as specified in fileName
@@ -225,11 +323,11 @@ def appendToCsv(fileName, varList, varNames, verbose=True):
     # Possibility: fileName exists. Only append new data.
     else:
 
-        # Abort if number of variables to append differs from number of elements in csv header.
-        with open(fileName, 'r') as infile:
-            header = infile.readlines()[0]
-            n_header = len(header.split(','))
+        # Header and last id come from the sidecar index (only new rows are read)
+        index = get_index(fileName)
+        n_header = len(index['header'])
 
+        # Abort if number of variables to append differs from number of elements in csv header.
         assert len(varList) + 2 == n_header, \
             f"""
             {funcName}(): You're trying to append a row of {len(varList)} variables to csv.
@@ -237,27 +335,25 @@ def appendToCsv(fileName, varList, varNames, verbose=True):
             the number of variables per row in the csv needs to stay consistent throughout all rows.
             """
 
-        # Determine new id value based on most recent line of file.
-        with open(fileName, 'r') as rfile:
-            rows = rfile.readlines()
-            try:
-                # Write id, time, data to file.
-                id_ = str(int(rows[-1].split(',')[0]) + 1)
-                with open(fileName, 'a') as wfile:
-                    varList = [str(var) for var in varList]
-                    row = '\n' + str(id_) + ',' + parsedTime + ',' + str(','.join(varList))
-                    wfile.write(row)
-                    rowsAdded.append(row)
-
-                    if verbose:
-                        print('Added new row to data: \t', row[1:])
-
-            # Possibility: id can't be determined from file. Abort.
-            except ValueError:
-                print('''
-                The last line of "%s" doesn't start with a valid id value (int).
-                Something is wrong with your data file.
-                No data has been written to the file.''' % fileName)
+        # Possibility: id can't be determined from file (or its snapshot). Abort.
+        last_id = get_last_id(fileName)
+        if last_id is None:
+            print('''
+            The last line of "%s" doesn't start with a valid id value (int).
+            Something is wrong with your data file.
+            No data has been written to the file.''' % fileName)
+            return
+
+        # Write id, time, data to file. New id = id of most recent row + 1.
+        id_ = str(last_id + 1)
+        with open(fileName, 'a') as wfile:
+            varList = [str(var) for var in varList]
+            row = '\n' + str(id_) + ',' + parsedTime + ',' + str(','.join(varList))
+            wfile.write(row)
+            rowsAdded.append(row)
+
+            if verbose:
+                print('Added new row to data: \t', row[1:])
 
 
 # Calls appendToCsv(). Values in d (nested dict) per pool/token become veriables per row in csv
@@ -274,12 +370,9 @@ def updateCSV(d, fileName, order=None, verbose=True, logfile=None, sample=True):
     if order:
         outDf = outDf.reindex(order)
 
-    # Count rows before appending data
-    if os.path.isfile(fileName):
-        with open(fileName, 'r') as file:
-            rowsBefore = len(file.readlines())
-    else:
-        rowsBefore = 0
+    # Count rows before appending data (sidecar index, no full read)
+    index = get_index(fileName)
+    rowsBefore = index['n_rows'] if index else 0
 
     # Append data
     for loan in outDf:
@@ -291,13 +384,11 @@ def updateCSV(d, fileName, order=None, verbose=True, logfile=None, sample=True):
         appendToCsv(fileName, varList, varNames, verbose=verbose)
 
     # Count rows after appending, prepare labeled sample row for printing
-    with open(fileName, 'r') as file:
-        lines = file.readlines()
-        rowsAfter = len(lines)
-        difference = rowsAfter - rowsBefore
-        headerList = lines[0].strip().split(',')
-        sampleRow = random.choice(lines[-difference:])
-        sampleList = sampleRow.strip().split(',')
+    index = get_index(fileName)
+    save_index(fileName)
+    difference = index['n_rows'] - rowsBefore
+    headerList = index['header']
+    sampleList = random.choice(read_tail(fileName, difference) or [headerList])
 
     if sample:
         printDf = pd.DataFrame(sampleList, index=headerList, columns=['Sample Row'])
@@ -316,17 +407,8 @@ def get_token_price(token_str):
     Assumes a string matching an existing html child of 'coingecko.com/en/coins/', i.e. 'ethereum'.
     Returns float of current asset price (USD) as given on coingecko.com.
     '''
-    url = 'https://www.coingecko.com/en/coins/' + token_str
-    userAgent = 'Mozilla/5.0 (Windows NT 6.1) AppleWebKit/537.36 (KHTML, like Gecko)' + \
-        ' Chrome/41.0.2228.0 Safari/537.36'
-    req = urllib.request.Request(url, headers= {'User-Agent' : userAgent})
-    html = urllib.request.urlopen(req)
-    bs = BeautifulSoup(html.read(), 'html.parser')
-
-    # Scrape price data
-    varList = bs.findAll('span', {'class': 'no-wrap'})
-    priceStr = varList[0].get_text()
-    price_usd = float(priceStr.replace(',','').replace('$',''))
+    html = fetch_coin_page(token_str)
+    price_usd = extract_token_price(html)
 
     # Sleep max 2 seconds before function can be called again
     sleep(random.random()*2)
@@ -334,74 +416,14 @@ def get_token_price(token_str):
     return price_usd
 
 
-# Helper function for get_token_metrics. Needed for market cap rank.
-def findCell(tableRows, rowKw, cellKw=None, getRawRow=False, stripToInt=True):
-    '''
-    Assumes tableRows = bs.findAll('tr').
-    Cycles through all table rows / cells of a website and returns a match
-
-    If no cellKw set:    Returns 1st matching row.
-    If cellKw set:       Returns first matching cell within that row.
-    If stripToInt:       Returns int (all numbers within that cell).
-
-    Example:
-                >>>findCell(tableRows, 'Price', '$')
-                >>>575
-    '''
-    funcName = inspect.currentframe().f_code.co_name
-    result = None
-
-    for row in tableRows:
-
-        # Possibility no cellKw: Return the first row containing rowKw
-        if rowKw in row.get_text():
-            result = str(row)
-
-            # Possibility getRaw: Return raw bs.Tag object
-            if getRawRow and result and not cellKw:
-                result = row
-                stripToInt = False
-
-    # Possibility cellKw: Return the first cell containing cellKw
-    if cellKw and result:
-        sCell = [str(cell) for cell in row if cellKw in result][0]
-        result = sCell
-
-    # Possibility stripToInt: Extract integers and return int
-    if stripToInt and result:
-        try:
-            n = int(''.join(filter(lambda i: i.isdigit(), result)))
-            result = n
-        except ValueError:
-            print( \
-            f'''
-            {funcName}():
-            There are no digits in the first row containing '{rowKw}' and
-            its first cell containing '{cellKw}'.
-            ''')
-
-    # Possibility: No rows found matching rowKw
-    if not result:
-        print(f'{funcName}(): No rows found containing {rowKw}!')
-    return result
-
-
-# Helper function: Removes any '$', '%', and ',' from target string and converts to float
-def clean(string):
-    # Abort if scraped metric is empty or None
-    assert string not in {None, ''}, \
-        f"""
-        Coingecko seems to have restructured their website.
-        One of the metrics couldn't be scraped. Check {funcName}().
-        """
-    return float(string.replace(',','').replace('$','').replace('%',''))
-
-
 # Helper function: Takes token address and returns symbol as specified in token_map
 def get_token_symbol(token_address, logfile=daily_log):
     try:
         return token_map[token_address]['symbol']
     except KeyError:
+        # Possibility: Token has been resolved on-chain by the token registry
+        if get_token_info(token_address).get('symbol'):
+            return get_token_info(token_address)['symbol']
         print(
             f'''
             Couldn't find a symbol for token {token_address} in token_map.
@@ -420,30 +442,32 @@ def get_address_by_symbol(symbol):
     return address
 
 
-# Looks up decimals for ERC20 in token_map. Queries web3 if not in token_map
+# Looks up decimals for ERC20 in the token registry. Resolves via web3 if unknown
 def get_decimals_for_erc20(address, logfile=None):
     '''
-    Takes ERC20 address string, gets abi, instantiates contract,
-    calls contract.functions.decimals(), returns value.
+    Takes ERC20 address string, returns its decimals as stored in the token
+    registry. Unknown tokens are resolved on-chain and stored for next time.
     '''
-    # Possibility: Address in token_map. Read value from there.
-    if address in token_map:
-        result = token_map[address]['decimals']
+    checksum_address = w3.toChecksumAddress(address)
 
-    # Possibility: Address not in token_map. Query web3.
-    else:
-        checksum_address = address
-        checksum_address = w3.toChecksumAddress(address)
-        abi_token = get_abi(checksum_version)
-        contract = instantiate_contract(checksum_version, abi_token)
-        result = contract.functions.decimals().call()
+    # Possibility: Address not in registry yet. Resolve (1 batched query).
+    if get_token_info(checksum_address).get('decimals') is None:
+        sync_token_registry(w3, [checksum_address], block_identifier=PINNED_BLOCK,
+                            multicall=MULTICALL, mainnet=MAINNET)
 
         if logfile:
-            message = f'ERC20 address {address} not found in token_map. ' \
+            message = f'ERC20 address {address} not found in token registry. ' \
                 'Decimals had to be fetched from web3.'
             log(logfile, message)
 
-    return result
+    # Possibility: decimals() failed and token isn't in token_map. Log, then abort.
+    try:
+        return get_decimals(checksum_address)
+    except ValueError as e:
+        print(e)
+        if logfile:
+            log(logfile, str(e))
+        raise
 
 
 # Decodes an ERC20 amount based on its number of decimals
@@ -466,32 +490,27 @@ def apply_decimals(amount, token_address=None, token_symbol=None, logfile=None):
         print('Either a token adress or symbol string has to be specified.')
 
 
-# Returns the current supply for an ERC20 token (web3 query). Nan if weird.
+# Returns the current supply for an ERC20 token (token registry). Nan if weird.
 def get_supply_for_erc20(symbol=None, address=None):
     '''
-    Queries web3 for totalSupply() of token, adjusts value using the
-    correct amount of decimals, returns current total supply.
+    Reads totalSupply() of token from the token registry (refreshed daily),
+    adjusts value using the correct amount of decimals, returns total supply.
     Accepts a token's symbol (i.e. 'LINK') or its contract address.
     '''
-    # contract.totalSupply() does not work for these tokens
-    not_possible = {'AMPL', 'AAVE', 'TUSD', 'USDC', 'USDT', 'WBTC', 'CRO'}
-    addies_not_possible = {get_address_by_symbol(s) for s in not_possible}
-
     if symbol:
-        if symbol in not_possible:
-            return np.nan
-
         address = get_address_by_symbol(symbol)
 
     if address:
-        if address in addies_not_possible:
+        checksum_address = w3.toChecksumAddress(address)
+        sync_token_registry(w3, [checksum_address], block_identifier=PINNED_BLOCK,
+                            multicall=MULTICALL, mainnet=MAINNET)
+        raw_supply = get_token_info(checksum_address).get('total_supply')
+
+        # Possibility: totalSupply() failed for this token
+        if raw_supply is None:
             return np.nan
 
-        checksum_address = w3.toChecksumAddress(address)
-        abi_token = get_abi(checksum_address)
-        contract = instantiate_contract(checksum_address, abi_token)
-        raw_supply = contract.caller.totalSupply()
-        decoded = apply_decimals(raw_supply, address)
+        decoded = apply_decimals(raw_supply, checksum_address)
 
         return decoded
 
@@ -501,10 +520,27 @@ def get_supply_for_erc20(symbol=None, address=None):
 
 # Helper function: Returns unique, most recent rows for rows in df column
 def keep_unique_most_recent(df, col='loan_address'):
-    most_recent_loans = df.sort_values('time').groupby(col).tail(1)
+    '''
+    Most recent = highest id (append order). The 'time' strings ('2021 Feb 18
+    16:24') don't sort chronologically across months ('Apr' < 'Feb').
+    '''
+    most_recent_loans = df.sort_values('id').groupby(col).tail(1)
+    return most_recent_loans
+
+
+# Helper function: Most recent row per loan of a (possibly compacted) history file
+def read_hist_latest(csv_hist_loans, col='loan_address'):
+    '''
+    Same rows as keep_unique_most_recent(pd.read_csv(csv_hist_loans)) over the
+    whole history, but only reads the snapshot written by compact_history()
+    and the current segment (csv_hist_loans). Rows are in chronological (id) order.
+    '''
+    files = [f for f in (snapshot_path(csv_hist_loans), csv_hist_loans) if os.path.isfile(f)]
+    data = pd.concat([pd.read_csv(f) for f in files], ignore_index=True)
+    most_recent_loans = data.sort_values('id').groupby(col).tail(1)
     return most_recent_loans
 
-# Scrapes coingecko and returns dict of various token metrics for 1 asset (calls findCell() for mc rank)
+# Scrapes coingecko and returns dict of various token metrics for 1 asset (see coingecko.py)
 def get_token_metrics(token_str, logfile=None, waitAfter=3):
     '''
     Assumes a string matching an existing html child of 'coingecko.com/en/coins/', i.e. 'ethereum'.
@@ -513,60 +549,19 @@ def get_token_metrics(token_str, logfile=None, waitAfter=3):
 
     # Get name of function for error messages (depends on inspect, sys)
     funcName = inspect.currentframe().f_code.co_name
-    tokenDict = {}
-
-    # Scrape coingecko content for given token
-    url = 'https://www.coingecko.com/en/coins/' + token_str
-    userAgent = 'Mozilla/5.0 (Windows NT 6.1) AppleWebKit/537.36 (KHTML, like Gecko)' + \
-        ' Chrome/41.0.2228.0 Safari/537.36'
-    req = urllib.request.Request(url, headers= {'User-Agent' : userAgent})
-    html = urllib.request.urlopen(req)
-    bs = BeautifulSoup(html.read(), 'html.parser')
-
-    # Load necessary html tag result sets
-    noWrapTags = bs.findAll('span', {'class': 'no-wrap'})  # list of html tags
-    mt1Tags = bs.findAll('div', {'class': 'mt-1'})
-    tableRows = bs.findAll('tr')
-
-    # Extract metrics that need html tag key attribute or other special treatment
+
+    # Scrape coingecko content for given token (single targeted pass)
+    html = fetch_coin_page(token_str)
+
+    # Possibility: Coingecko changed their layout. Report the failing field.
     try:
-        manuallyScraped = ['priceBTC', 'mcBTC']
-        priceBTC = float(noWrapTags[0].get('data-price-btc'))
-        mcBTC = float(noWrapTags[1].get('data-price-btc'))
-        circSupply = float(mt1Tags[6].get_text().split('/')[0].strip().replace(',',''))
-        mcRank = findCell(tableRows, 'Rank', stripToInt=True)
-
-        # If supply is infinite (as in ETH), replace with inf
-        try:
-            totalSupply = float(mt1Tags[6].get_text().split('/')[1].strip().replace(',',''))
-        except ValueError:
-            totalSupply = np.inf
-
-    # Possibility: str-to-float conversion failed because it got None as argument
-    except TypeError:
-        print(f"""
-            Coingecko seems to have restructured their website.
-            One of these metrics couldn't be scraped:
-            {manuallyScraped}
-            Check {funcName}().
-            """)
-
-    # Extract all other metrics from text and add all to the dict
-    tokenDict['priceUSD'] = clean(noWrapTags[0].get_text())
-    tokenDict['priceBTC'] = priceBTC
-    tokenDict['mcRank'] = mcRank
-    tokenDict['mcUSD'] = clean(noWrapTags[1].get_text())
-    tokenDict['mcBTC'] = mcBTC
-    tokenDict['circSupply'] = circSupply
-    tokenDict['totalSupply'] = totalSupply
-    tokenDict['24hVol'] = clean(noWrapTags[2].get_text())
-    tokenDict['24hLow'] = clean(noWrapTags[3].get_text())
-    tokenDict['24hHigh'] = clean(noWrapTags[4].get_text())
-    tokenDict['7dLow'] = clean(noWrapTags[10].get_text())
-    tokenDict['7dHigh'] = clean(noWrapTags[11].get_text())
-    tokenDict['ATH'] = clean(noWrapTags[12].get_text())
-    tokenDict['ATL'] = clean(noWrapTags[13].get_text())
-    tokenDict['symbol'] = noWrapTags[0].get('data-coin-symbol')
+        tokenDict = extract_token_metrics(html)
+    except ScrapeError as e:
+        message = f"Check {funcName}() for '{token_str}': {e}"
+        print(message)
+        if logfile:
+            log(logfile, message)
+        raise
 
     # Option: Write to logFile if any scraped metric except 'symbol' is not a number
     if logfile:
@@ -576,7 +571,7 @@ def get_token_metrics(token_str, logfile=None, waitAfter=3):
         for key, metric in filtered.items():
             if type(metric) not in allowedTypes:
                 message = f"Check {funcName}(): Scraped value for \
-                    '{tokenStr}': '{key}' is '{metric}', which is not a number."
+                    '{token_str}': '{key}' is '{metric}', which is not a number."
                 log(logfile, message)
 
     # Wait for max {waitAfter} seconds before function can be called again (= scrape in a nice way)
@@ -585,42 +580,26 @@ def get_token_metrics(token_str, logfile=None, waitAfter=3):
     return tokenDict
 
 
-# Creates/overwrites a csv file containing all loans not yet repaid
-def replace_active_loans(csv_active_loans, csv_hist_loans, var_order, logfile=None):
+# Keeps a csv file containing all loans not yet repaid up to date
+def replace_active_loans(csv_active_loans, var_order, logfile=None):
     '''
-    Expects 2 csv files (daily active loans, historical loan data)
-    and the var_order for printing to csv.
+    Expects the csv file of daily active loans and the var_order for printing
+    to csv. Active loans are taken from ALL_LOANS_DATA (no refetching). Only
+    inserts, updates and removals are applied. The file is replaced
+    atomically, so readers never see a missing or partial file.
     '''
-    global ALL_LOANS
     global ALL_LOANS_DATA
 
-    # Remove old version of csv_active_loans
-    if os.path.isfile(csv_active_loans):
-        os.remove(csv_active_loans)
-
-
-    # Possibility: csv file exists. Discount addresses of repaid loans
-    if os.path.isfile(csv_hist_loans):
-        data = pd.read_csv(csv_hist_loans, index_col='id')
-        is_repaid = data['loan_status'] != 0
-
-        repaid_loans = set(data[is_repaid]['loan_address'].tolist())
-        active_loans = ALL_LOANS - repaid_loans
-
-        # Append active loan data to csv
-        to_append = {loan: get_loan_data(loan) for loan in active_loans}
+    active_loans = {k: [v[var] for var in var_order] for k, v in ALL_LOANS_DATA.items() \
+                    if v['loan_status'] == 0}
 
-        updateCSV(to_append, fileName=csv_active_loans, order=var_order,
-                  verbose=False, logfile=None, sample=False)
+    delta = apply_delta(csv_active_loans, active_loans, var_order, key='loan_address')
 
-
-    # Possibility: No csv file. Save all active loans
-    else:
-        active_loans = {k: v for k, v in ALL_LOANS_DATA.items() \
-                        if v['loan_status'] == 0}
-
-        updateCSV(active_loans, fileName=csv_active_loans, order=var_order,
-                  verbose=False, logfile=None, sample=False)
+    message = f"Active loans: {len(delta['inserted'])} added, " \
+        f"{len(delta['updated'])} updated, {len(delta['removed'])} removed."
+    print(message)
+    if logfile:
+        log(logfile, message)
 
     print(f'{len(active_loans)} loan(s) currently active...')
 
@@ -635,7 +614,7 @@ def update_hist_loans(csv_hist_loans, var_order, logfile=None):
 
     # Possibility: database exists already. Append loans if new or status has changed
     if os.path.isfile(csv_hist_loans):
-        data = pd.read_csv(csv_hist_loans, index_col='id')
+        data = read_hist_latest(csv_hist_loans)
 
 
         # Possibility: New loans created today. Append to csv
@@ -659,11 +638,11 @@ def update_hist_loans(csv_hist_loans, var_order, logfile=None):
 
         # Possibility: The status of a known loan has changed. Append to csv
             # TODO: Filter by max loan time
-        data = pd.read_csv(csv_hist_loans)
+        data = read_hist_latest(csv_hist_loans)
         all_loans = pd.DataFrame(ALL_LOANS_DATA).T
 
         # Get latest version of each loan from dataset for comparison
-        most_recent_loans = data.sort_values('time').groupby('loan_address').tail(1)
+        most_recent_loans = data
 
         # Equalize shape and order differences
         keep_cols = all_loans.columns
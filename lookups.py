@@ -1,7 +1,45 @@
 # 'status' flag for loans:              0 = active, 1 = repaid, 2 = defaulted
 # 'status' flag for offers/requests:    0 = pending, 1 = accepted, 2 = canceled
 
-# TODO: Store ABIs here
+# Minimal ERC20 ABI. Enough to read immutable token fields and current supply
+# without fetching every token's full ABI from Etherscan.
+ERC20_ABI = [
+    {'constant': True, 'inputs': [], 'name': 'decimals', 'outputs':
+        [{'name': '', 'type': 'uint8'}], 'stateMutability': 'view', 'type': 'function'},
+    {'constant': True, 'inputs': [], 'name': 'symbol', 'outputs':
+        [{'name': '', 'type': 'string'}], 'stateMutability': 'view', 'type': 'function'},
+    {'constant': True, 'inputs': [], 'name': 'totalSupply', 'outputs':
+        [{'name': '', 'type': 'uint256'}], 'stateMutability': 'view', 'type': 'function'}
+    ]
+
+# Multicall2 (mainnet). tryAggregate() batches many calls into a single eth_call
+# and reports failing calls instead of reverting the whole batch.
+multicall_address = '0x5BA1e12693Dc8F9c48aAD8770482f4739bEeD696'
+
+MULTICALL_ABI = [
+    {'inputs': [
+        {'name': 'requireSuccess', 'type': 'bool'},
+        {'components': [
+            {'name': 'target', 'type': 'address'},
+            {'name': 'callData', 'type': 'bytes'}],
+         'name': 'calls', 'type': 'tuple[]'}],
+     'name': 'tryAggregate',
+     'outputs': [
+        {'components': [
+            {'name': 'success', 'type': 'bool'},
+            {'name': 'returnData', 'type': 'bytes'}],
+         'name': 'returnData', 'type': 'tuple[]'}],
+     'stateMutability': 'nonpayable', 'type': 'function'}
+    ]
+
+# Preferred order how the loan variables (columns) are stored in the csv files.
+# Don't change once first data has been written to file.
+var_order = [
+    'loan_status', 'is_defaulted', 'address_borrower',  'principal',
+    'collateral', 'interest', 'ts_start', 'ts_due', 'duration', 'ts_repaid',
+    'collateral_balance', 'address_lender', 'liquidatable_t_allowance',
+    'address_lending_token', 'address_collateral_token'
+    ]
 
 # Map keys to data types for converion by convert_values_to_human_readable()
 type_map = {
@@ -28,7 +66,7 @@ token_map = {
     '0x111111111117dC0aa78b770fA6A738034120C302':
         {'symbol': '1INCH', 'coingecko_str': '1inch', 'decimals': 18},
     '0xD46bA6D942050d489DBd938a2C909A5d5039A161':
-        {'symbol': 'AMPL','coingecko_str': 'ampleforth', 'decimals': 18},
+        {'symbol': 'AMPL','coingecko_str': 'ampleforth', 'decimals': 9},
     '0x1F573D6Fb3F13d689FF844B4cE37794d79a7FF1C':
         {'symbol': 'BNT', 'coingecko_str': 'bancor-network', 'decimals': 18},
     '0x7Fc66500c84A76Ad7e9c93437bFc5Ac33E2DDaE9':
@@ -46,7 +84,7 @@ token_map = {
     '0x2ba592F78dB6436527729929AAf6c908497cB200':
         {'symbol': 'CREAM', 'coingecko_str': 'cream', 'decimals': 18},
     '0xA0b73E1Ff0B80914AB6fe0444E65848C4C34450b':
-        {'symbol': 'CRO', 'coingecko_str': 'crypto-com-coin', 'decimals': 18},
+        {'symbol': 'CRO', 'coingecko_str': 'crypto-com-coin', 'decimals': 8},
     '0xD533a949740bb3306d119CC777fa900bA034cd52':
         {'symbol': 'CRV', 'coingecko_str': 'curve-dao-token', 'decimals': 18},
     '0xF629cBd94d3791C9250152BD8dfBDF380E2a3B9c':
@@ -78,11 +116,11 @@ token_map = {
     '0x1f9840a85d5aF5bf1D1762F925BDADdC4201F984':
         {'symbol': 'UNI', 'coingecko_str': 'uniswap', 'decimals': 18},
     '0xA0b86991c6218b36c1d19D4a2e9Eb0cE3606eB48':
-        {'symbol': 'USDC', 'coingecko_str': 'usd-coin', 'decimals': 18},
+        {'symbol': 'USDC', 'coingecko_str': 'usd-coin', 'decimals': 6},
     '0xdAC17F958D2ee523a2206206994597C13D831ec7':
-        {'symbol': 'USDT', 'coingecko_str': 'tether', 'decimals': 18},
+        {'symbol': 'USDT', 'coingecko_str': 'tether', 'decimals': 6},
     '0x2260FAC5E5542a773Aa44fBCfeDf7C193bc2C599':
-        {'symbol': 'WBTC', 'coingecko_str': 'wrapped-bitcoin', 'decimals': 18},
+        {'symbol': 'WBTC', 'coingecko_str': 'wrapped-bitcoin', 'decimals': 8},
     '0x0bc529c00C6401aEF6D220BE8C6Ea1667F6Ad93e':
         {'symbol': 'YFI', 'coingecko_str': 'yearn-finance', 'decimals': 18},
     '0xE41d2489571d322189246DaFA5ebDe1F4699F498':
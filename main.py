@@ -6,92 +6,255 @@
 #    yield.credit loan factory contract. It conditionally creates or appends
 #    platform metrics to csv files. Any file not existing yet will be created.
 #    The script is intended to be scheduled daily using crontab for example.
+#
+#    Usage:  python main.py [sync|active|metrics|prices|report|compact|stress] [-h]
+#            Without subcommand, the daily update ('sync') is run.
+#
+#    Every subcommand only imports the modules it needs (web3, pandas, ...
+#    are imported inside the subcommand functions), so light subcommands
+#    start fast. See bench_startup.py.
 #############################################################################
 
-print('Script started...')
-
-import os
-from lookups import type_map, token_map
-from functions import log, get_abi, get_token_price
+import argparse
 
 
 # Specify paths to data files. Files will be created if not found.
-csv_active_loans = 'yield_active_loans.csv'     # replaced daily
+csv_active_loans = 'yield_active_loans.csv'     # updated daily
 csv_hist_loans = 'yield_hist_loan_activity.csv' # appended to if a loan status changes
 csv_daily_metrics = 'yield_daily_metrics.csv'   # appended to daily
 logfile = 'yield_logging.txt'                   # appended to daily
 
 
-# Specify the preferred order how the variables (columns )should be stored
-# in the csv file. Don't change once first data has been written to file.
+# The preferred order how the variables (columns) are stored in the csv
+# files is specified as var_order in lookups.py.
 
-var_order = [
-    'loan_status', 'is_defaulted', 'address_borrower',  'principal',
-    'collateral', 'interest', 'ts_start', 'ts_due', 'duration', 'ts_repaid',
-    'collateral_balance', 'address_lender', 'liquidatable_t_allowance',
-    'address_lending_token', 'address_collateral_token'
-    ]
+
+# Contract addresses
+loan_address = '0xbFE28f2d7ade88008af64764eA16053F705CF1f0'
+loan_fac_address = '0x49aF18b1ecA40Ef89cE7F605638cF675B70012A7'
+yld_token_address = '0xdcb01cc464238396e213a6fdd933e36796eaff9f'
 
 
 #############################################################################
 #
-# Set global variables BTC_PRICE, ALL_LOANS, LOAN_FAC, ALL_LOANS_DATA
+# Subcommands
 #
 #############################################################################
 
 
-# BTC_PRICE <- current BTC price used for BTC-denominated metrics
-try:
-    BTC_PRICE = get_token_price('bitcoin')
-except:
-    message = "Couldn't scrape BTC price from Coingecko."
-    print(message)
-    log(logfile, message)
+# Daily update: prices, active loans, loan history (all deployments if --config)
+def sync(args):
+    print('Script started...')
 
-print(f'Successfully scraped current BTC price: {round(BTC_PRICE)} USD')
-print('Updating database now...')
+    from functions import log, get_token_price
+    from prices import npz_prices, fetch_current_prices, record_prices
 
+    # BTC_PRICE <- current BTC price used for BTC-denominated metrics
+    try:
+        BTC_PRICE = get_token_price('bitcoin')
+        print(f'Successfully scraped current BTC price: {round(BTC_PRICE)} USD')
+    except:
+        BTC_PRICE = None
+        message = "Couldn't scrape BTC price from Coingecko."
+        print(message)
+        log(logfile, message)
 
-# Contract addresses
-loan_address = '0xbFE28f2d7ade88008af64764eA16053F705CF1f0'
-loan_fac_address = '0x49aF18b1ecA40Ef89cE7F605638cF675B70012A7'
-yld_token_address = '0xdcb01cc464238396e213a6fdd933e36796eaff9f'
-# Get contract ABIs
+    # Add today's prices of BTC and all tokens in token_map to the price store
+    try:
+        current = fetch_current_prices()
+        if BTC_PRICE:
+            current['bitcoin'] = BTC_PRICE
+        record_prices(current, path=npz_prices)
+    except:
+        message = f"Couldn't update price store '{npz_prices}'."
+        print(message)
+        log(logfile, message)
+
+    # Possibility: Several deployments. Run each in its own worker process.
+    if args.config:
+        from shards import load_deployments, run_all, aggregate_metrics
+        deployments = load_deployments(args.config)
+        run_all(deployments)
+        print(aggregate_metrics(deployments))
+        return
+
+    from lookups import var_order
+    from functions import connect, load_loans, replace_active_loans, update_hist_loans
+
+    print('Updating database now...')
+
+    # Connect to Infura & Etherscan, get contract ABIs and all loan data
+    connect()
+    load_loans(loan_fac_address, loan_address, logfile=logfile)
+    print('Successfully connected to APIs...')
+
+    # Get not yet repaid loans. Save to csv.
+    print(f'Saving currently active loans to \'{csv_active_loans}\'...')
+    replace_active_loans(csv_active_loans, var_order, logfile)
+
+    # Get loans that got defaulted/repaid since last update. Append to csv.
+    print('Checking for loans with a recently changed status...')
+    update_hist_loans(csv_hist_loans, var_order, logfile=logfile)
+
+    # TODO: Get metrics for frontend
+
+    # Scrapes data for tokens used in loans so far & saves to csv
+    #update_daily_metrics(csv_daily_metrics)
+
+    # Reads from csv
+    #metrics_dict = get_metrics_for_frontend()
+    # updates global TOKEN_METRICS_TODAY
+
+
+# Only updates the file of currently active loans
+def active(args):
+    from lookups import var_order
+    from functions import connect, load_loans, replace_active_loans
 
-ABI_LOAN_FAC = get_abi(loan_fac_address)
-#abi_token = get_abi(yld_token_address)
-ABI_LOAN = get_abi(loan_address)
+    connect()
+    load_loans(loan_fac_address, loan_address, logfile=logfile)
+    replace_active_loans(csv_active_loans, var_order, logfile)
 
-from functions import *
 
-print('Successfully connected to APIs...')
+# Aggregated metrics view over all deployments in the config file
+def metrics(args):
+    from shards import load_deployments, aggregate_metrics
 
+    # Possibility: No config. Read the files of the single deployment ('sync').
+    if not args.config:
+        from tokens import registry_file
+        paths = {'mainnet': {'active': csv_active_loans, 'registry': registry_file}}
+        print(aggregate_metrics([{'name': 'mainnet'}], paths=paths))
+        return
 
+    print(aggregate_metrics(load_deployments(args.config)))
 
 
+# Records today's prices, backfills the price store or shows what's in it
+def prices(args):
+    import prices as price_store
+
+    if args.backfill:
+        price_store.backfill()
+    elif not args.show:
+        price_store.record_prices(price_store.fetch_current_prices())
+
+    store = price_store.load_price_store()
+    print(f"{len(store['usd'])} daily prices of {len(store['assets'])} assets "
+          f"in '{price_store.npz_prices}'.")
+
+
+# Prints analytics over the loan history (read in memory-capped chunks)
+def report(args):
+    import analytics
+
+    max_memory = args.max_memory * 1024**2
+    print('Volume per lending token:\n',
+          analytics.token_volume(csv_hist_loans, max_memory), '\n')
+    print('Active exposure per borrower:\n',
+          analytics.borrower_exposure(csv_hist_loans, max_memory), '\n')
+    print('Status transitions per month:\n',
+          analytics.status_transitions(csv_hist_loans, max_memory))
+
+
+# Folds the loan history into snapshot + monthly archive segments
+def compact(args):
+    from storage import compact_history, snapshot_path
+
+    archived = compact_history(csv_hist_loans)
+    for month, n_rows in archived.items():
+        print(f'{month}: {n_rows} row(s) archived.')
+    print(f"Compacted '{csv_hist_loans}'. Snapshot: '{snapshot_path(csv_hist_loans)}'")
+
+
+# Collateral stress test of active loans under random price scenarios
+def stress(args):
+    import numpy as np
+    import stress as engine
+    from lookups import token_map
+    from tokens import get_token_info
+
+    loans = engine.load_active_loans(csv_active_loans)
+    prices = engine.current_prices(loans['tokens'])
+    shocks = engine.random_shocks(args.scenarios, len(loans['tokens']),
+                                  args.volatility, seed=args.seed)
+    result = engine.stress_test(loans, prices, shocks, min_ratio=args.min_ratio)
+
+    print(f"{len(loans['loans'])} active loans, {args.scenarios} scenarios "
+          f"(volatility {args.volatility}).")
+    if np.isnan(prices).any():
+        print(f'{np.isnan(prices).sum()} token(s) without price in the price store. '
+              "Their loans are skipped. Run 'python main.py prices' first.")
+    print(f"Loans at risk: mean {result['n_at_risk'].mean():.1f}, "
+          f"max {result['n_at_risk'].max(initial=0)}\n")
+
+    # Principal at risk per lending token (USD): mean and worst scenario
+    at_risk = result['principal_at_risk']
+    for i, token in enumerate(loans['tokens']):
+        if at_risk[:, i].any():
+            symbol = get_token_info(token).get('symbol') \
+                or token_map.get(token, {}).get('symbol', token)
+            print(f'{symbol:<8} mean {at_risk[:, i].mean():>14,.0f} USD   '
+                  f'worst {at_risk[:, i].max():>14,.0f} USD')
+
 
 #############################################################################
 #
-# Update database with current loan information
+# Command line interface
 #
 #############################################################################
 
 
-# Get not yet repaid loans. Save to csv.
-print(f'Saving currently active loans to \'{csv_active_loans}\'...')
-replace_active_loans(csv_active_loans, csv_hist_loans, var_order, logfile)
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Keeps track of all loans taken on yield.credit.')
+    subparsers = parser.add_subparsers(dest='command')
+
+    p = subparsers.add_parser('sync', help='daily update (default)')
+    p.add_argument('--config', help='json file of deployments to track in parallel')
+    p.set_defaults(func=sync)
+
+    p = subparsers.add_parser('active', help='only update the active loans file')
+    p.set_defaults(func=active)
+
+    p = subparsers.add_parser('metrics', help='aggregated metrics over all deployments')
+    p.add_argument('--config', help='json file of deployments (default: the one of sync)')
+    p.set_defaults(func=metrics)
+
+    p = subparsers.add_parser('prices', help="record today's prices in the price store")
+    p.add_argument('--backfill', action='store_true', help='fetch full price history')
+    p.add_argument('--show', action='store_true', help="only show the store's content")
+    p.set_defaults(func=prices)
+
+    p = subparsers.add_parser('report', help='analytics over the loan history')
+    p.add_argument('--max-memory', type=int, default=64,
+                   help='peak memory per chunk of rows in MB (per-loan state comes on top)')
+    p.set_defaults(func=report)
+
+    p = subparsers.add_parser('compact', help='archive the loan history of past months')
+    p.set_defaults(func=compact)
+
+    p = subparsers.add_parser('stress', help='collateral stress test of active loans')
+    p.add_argument('--scenarios', type=int, default=1000)
+    p.add_argument('--volatility', type=float, default=0.3, help='of lognormal price moves')
+    p.add_argument('--min-ratio', type=float, default=1.0,
+                   help='at risk if collateral value < min ratio * debt value')
+    p.add_argument('--seed', type=int)
+    p.set_defaults(func=stress)
+
+    args = parser.parse_args(argv)
 
-# Get loans that got defaulted/repaid since last update. Append to csv.
-print('Checking for loans with a recently changed status...')
-update_hist_loans(csv_hist_loans, var_order, logfile=logfile)
+    # Possibility: No subcommand (i.e. crontab). Run the daily update.
+    if args.command is None:
+        args = parser.parse_args(['sync'])
 
+    return args
 
 
-# TODO: Get metrics for frontend
+def main(argv=None):
+    args = parse_args(argv)
+    args.func(args)
 
-# Scrapes data for tokens used in loans so far & saves to csv
-#update_daily_metrics(csv_daily_metrics)
 
-# Reads from csv
-#metrics_dict = get_metrics_for_frontend()
-# updates global TOKEN_METRICS_TODAY
+if __name__ == '__main__':
+    main()
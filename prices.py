@@ -0,0 +1,204 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#############################################################################
+#    Local store of daily USD prices for BTC and every token in token_map.
+#    Prices are kept in flat NumPy arrays sorted by (asset, day), so that
+#    as-of lookups for any number of (asset, timestamp) pairs are a single
+#    np.searchsorted() call. Filled daily by main.py and by backfill().
+#
+#    Usage:  python prices.py backfill
+#############################################################################
+
+import os, sys, json
+import random
+import urllib.request
+from time import sleep, time
+
+import numpy as np
+
+from lookups import token_map
+from tokens import TOKEN_REGISTRY, load_token_registry, get_decimals
+
+
+# Specify path to price store. File will be created if not found.
+npz_prices = 'yield_prices.npz'
+
+# Assets are identified by their coingecko string, i.e. 'bitcoin', 'chainlink'
+BTC = 'bitcoin'
+ALL_ASSETS = [BTC] + sorted({v['coingecko_str'] for v in token_map.values()})
+
+SECONDS_PER_DAY = 24 * 3600
+
+api_url = 'https://api.coingecko.com/api/v3'
+
+
+# Helper function: Empty price store
+def empty_store():
+    return {'assets': np.array([], dtype=str),
+            'asset': np.array([], dtype='int32'),
+            'day': np.array([], dtype='int32'),
+            'usd': np.array([], dtype='float64')}
+
+
+# Loads price store from file. Empty store if no file yet.
+def load_price_store(path=npz_prices):
+    '''
+    Returns dict of arrays:
+    assets  coingecko strings. 'asset' holds indices into this array
+    asset   asset index of each price        (sorted by asset, then day)
+    day     day of each price (days since 1970-01-01 UTC)
+    usd     daily price in USD
+    '''
+    if not os.path.isfile(path):
+        return empty_store()
+
+    with np.load(path) as data:
+        return {key: data[key] for key in ('assets', 'asset', 'day', 'usd')}
+
+
+# Writes price store to file (temp file + rename, so no half-written file)
+def save_price_store(store, path=npz_prices):
+    tmp_path = path + '.tmp.npz'
+    np.savez(tmp_path, **store)
+    os.replace(tmp_path, path)
+
+
+# Helper function: Combined sort key of (asset index, day)
+def store_keys(asset, day):
+    return (np.asarray(asset, dtype='int64') << 32) | np.asarray(day, dtype='int64')
+
+
+# Adds daily prices of one asset to the store. Newer values replace older ones.
+def add_prices(store, asset_str, days, usd):
+    '''Takes arrays of days (since epoch) and USD prices. Returns the new store.'''
+    assets = list(store['assets'])
+    if asset_str not in assets:
+        assets.append(asset_str)
+    i_asset = assets.index(asset_str)
+
+    days = np.asarray(days, dtype='int32')
+    asset = np.concatenate([store['asset'], np.full(len(days), i_asset, dtype='int32')])
+    day = np.concatenate([store['day'], days])
+    usd = np.concatenate([store['usd'], np.asarray(usd, dtype='float64')])
+
+    # Sort by (asset, day). Keep last occurrence of duplicates (= the new value)
+    keys = store_keys(asset, day)
+    order = np.argsort(keys, kind='stable')
+    keys = keys[order]
+    keep = np.append(keys[1:] != keys[:-1], True)
+    order = order[keep]
+
+    return {'assets': np.array(assets, dtype=str),
+            'asset': asset[order], 'day': day[order], 'usd': usd[order]}
+
+
+# Looks up the price of each asset as of each timestamp (vectorized)
+def price_asof(store, assets, ts, max_age_days=None):
+    '''
+    Takes arrays of coingecko strings and unix timestamps of the same length.
+    Returns array of USD prices of the latest day at or before each ts.
+    NaN if there is no such price (or it is older than max_age_days).
+    '''
+    assets = np.asarray(assets, dtype=str)
+    days = np.asarray(ts, dtype='int64') // SECONDS_PER_DAY
+
+    # Map coingecko strings to asset indices (-1 if not in store)
+    unique, inverse = np.unique(assets, return_inverse=True)
+    lookup = {a: i for i, a in enumerate(store['assets'])}
+    asset = np.array([lookup.get(a, -1) for a in unique], dtype='int64')[inverse]
+
+    # One join: Position of the last stored key <= query key
+    keys = store_keys(store['asset'], store['day'])
+    pos = np.searchsorted(keys, store_keys(asset, days), side='right') - 1
+    pos_ = pos.clip(0)
+
+    valid = (asset >= 0) & (pos >= 0) & (store['asset'][pos_] == asset) \
+        if len(keys) else np.zeros(len(days), dtype=bool)
+    if max_age_days is not None and len(keys):
+        valid &= days - store['day'][pos_] <= max_age_days
+
+    prices = np.full(len(days), np.nan)
+    prices[valid] = store['usd'][pos[valid]]
+    return prices
+
+
+# Values raw token amounts in USD and BTC as of each timestamp
+def value_in_usd_btc(store, amounts, token_addresses, ts, decimals=None):
+    '''
+    Takes arrays of raw ERC20 amounts, token addresses and unix timestamps
+    (i.e. principal, address_lending_token, ts_start of historical loans).
+    decimals: array of decimals per amount. Default: token registry / token_map.
+    Returns (usd, btc) arrays. NaN for tokens without price data.
+    Raises ValueError for tokens whose decimals are unknown.
+    '''
+    token_addresses = np.asarray(token_addresses, dtype=str)
+    assets = np.array([token_map.get(a, {}).get('coingecko_str', '')
+                       for a in token_addresses], dtype=str)
+    if decimals is None:
+        if not TOKEN_REGISTRY:
+            load_token_registry()
+        decimals = [get_decimals(a) for a in token_addresses]
+
+    amounts = np.asarray(amounts, dtype='float64') / 10.0 ** np.asarray(decimals)
+    usd = amounts * price_asof(store, assets, ts)
+    btc = usd / price_asof(store, np.full(len(usd), BTC), ts)
+    return usd, btc
+
+
+# Gets current USD prices of many assets with 1 request to the coingecko API
+def fetch_current_prices(assets=ALL_ASSETS):
+    '''Returns dict {coingecko string: USD price}.'''
+    url = f"{api_url}/simple/price?ids={','.join(assets)}&vs_currencies=usd"
+    with urllib.request.urlopen(url) as response:
+        data = json.load(response)
+    return {asset: data[asset]['usd'] for asset in assets if asset in data}
+
+
+# Gets daily USD prices of one asset since its listing from the coingecko API
+def fetch_price_history(asset_str, days='max'):
+    '''Returns (days since epoch, USD prices) as arrays.'''
+    url = f'{api_url}/coins/{asset_str}/market_chart?vs_currency=usd&days={days}&interval=daily'
+    with urllib.request.urlopen(url) as response:
+        data = json.load(response)
+
+    prices = np.array(data['prices'], dtype='float64').reshape(-1, 2)
+    return (prices[:, 0] // 1000 // SECONDS_PER_DAY).astype('int32'), prices[:, 1]
+
+
+# Stores today's prices (called by the daily run)
+def record_prices(prices, ts=None, path=npz_prices):
+    '''Takes dict {coingecko string: USD price}, i.e. from fetch_current_prices().'''
+    day = int((ts or time()) // SECONDS_PER_DAY)
+    store = load_price_store(path)
+    for asset_str, usd in prices.items():
+        store = add_prices(store, asset_str, [day], [usd])
+    save_price_store(store, path)
+    return store
+
+
+# Fills the store with the full daily price history of all assets
+def backfill(assets=ALL_ASSETS, path=npz_prices, waitAfter=3):
+    store = load_price_store(path)
+
+    for asset_str in assets:
+        try:
+            days, usd = fetch_price_history(asset_str)
+            store = add_prices(store, asset_str, days, usd)
+            print(f'{asset_str}: {len(days)} daily prices.')
+        except Exception as e:
+            print(f"Couldn't backfill prices for '{asset_str}' ({e}).")
+
+        # Wait for max {waitAfter} seconds before next request (= scrape in a nice way)
+        sleep(random.random() * waitAfter)
+
+    save_price_store(store, path)
+    return store
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['backfill']:
+        backfill()
+    else:
+        store = load_price_store()
+        print(f"{len(store['usd'])} daily prices of {len(store['assets'])} assets in {npz_prices}.")
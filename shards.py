@@ -0,0 +1,172 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#############################################################################
+#    Tracks several LoanFactory deployments / networks at once.
+#    Every deployment in the config file (deployments.json) is a shard that
+#    runs in its own worker process, with its own provider and its own
+#    storage partition (data/<name>/). Shards run in parallel, so adding a
+#    deployment doesn't make the daily run slower end to end.
+#    Afterwards one aggregated metrics view is built over all partitions.
+#
+#    Usage:  python shards.py [path/to/deployments.json]
+#############################################################################
+
+import os, sys, json
+from multiprocessing import Pool
+
+from lookups import token_map, var_order, multicall_address
+
+
+config_file = 'deployments.json'
+data_dir = 'data'
+csv_aggregated_metrics = 'yield_aggregated_metrics.csv'   # replaced daily
+
+
+# Reads list of deployments from config file
+def load_deployments(path=config_file):
+    '''
+    Expects a json list of deployments, each a dict with keys:
+    name            unique name, also used as name of the storage partition
+    provider_url    http(s) url of an ETH node. null = Infura (mainnet)
+    etherscan_net   network name for the Etherscan API, i.e. 'main', 'kovan'
+    loan_factory    address of LoanFactory.sol
+    loan            address of any Loan.sol (to get its ABI)
+    multicall       address of Multicall2 on the network. null = none (tokens
+                    are queried one by one). Default: mainnet address on 'main'
+    '''
+    with open(path, 'r') as file:
+        deployments = json.load(file)
+
+    names = [d['name'] for d in deployments]
+    assert len(names) == len(set(names)), \
+        f'Deployment names in {path} must be unique: {names}'
+
+    return deployments
+
+
+# Helper function: Paths of all data files within the partition of a deployment
+def shard_paths(name, data_dir=data_dir):
+    partition = os.path.join(data_dir, name)
+    return {
+        'partition': partition,
+        'active': os.path.join(partition, 'yield_active_loans.csv'),
+        'hist': os.path.join(partition, 'yield_hist_loan_activity.csv'),
+        'registry': os.path.join(partition, 'yield_token_registry.json'),
+        'log': os.path.join(partition, 'yield_logging.txt')
+        }
+
+
+# Runs the daily update for one deployment. Executed in a worker process.
+def run_shard(deployment, data_dir=data_dir):
+    '''
+    Connects to the deployment's own provider and updates the active and
+    historical loan files in its own partition. Returns (name, #loans).
+    '''
+    # Imported here: Every worker process gets its own connection & globals
+    import functions
+
+    paths = shard_paths(deployment['name'], data_dir)
+    os.makedirs(paths['partition'], exist_ok=True)
+
+    functions.connect(deployment.get('provider_url'),
+                      etherscan_net=deployment.get('etherscan_net', 'main'))
+    mainnet = deployment.get('etherscan_net', 'main') == 'main'
+    functions.load_loans(deployment['loan_factory'], deployment['loan'],
+                         registry_path=paths['registry'], logfile=paths['log'],
+                         multicall=deployment.get('multicall',
+                                                  multicall_address if mainnet else None),
+                         mainnet=mainnet)
+
+    functions.replace_active_loans(paths['active'], var_order, logfile=paths['log'])
+    functions.update_hist_loans(paths['hist'], var_order, logfile=paths['log'])
+
+    return deployment['name'], len(functions.ALL_LOANS)
+
+
+# Runs all shards in parallel, one worker process each
+def run_all(deployments, data_dir=data_dir):
+    '''
+    Returns dict {name: #loans}. A failing shard is reported and skipped,
+    the others still finish. Every worker process exits after its shard
+    (maxtasksperchild=1), so no shard inherits globals of another network.
+    '''
+    results = {}
+
+    # Possibility: Nothing to track (Pool needs at least 1 process)
+    if not deployments:
+        return results
+
+    with Pool(processes=len(deployments), maxtasksperchild=1) as pool:
+        futures = {d['name']: pool.apply_async(run_shard, (d, data_dir)) for d in deployments}
+
+        for name, future in futures.items():
+            try:
+                _, n_loans = future.get()
+                results[name] = n_loans
+                print(f'{name}: {n_loans} loan(s) tracked.')
+            except Exception as e:
+                print(f'{name}: Shard failed ({type(e).__name__}: {e}).')
+
+    return results
+
+
+# Builds one metrics view over the active loans of all partitions
+def aggregate_metrics(deployments, data_dir=data_dir, fileName=csv_aggregated_metrics,
+                      paths=None):
+    '''
+    Returns a DataFrame with one row per deployment & lending token:
+    number of active loans and active principal (decimals applied).
+    Also saves it to fileName (replaced atomically).
+    paths: {name: {'active': csv, 'registry': json}} to read a deployment
+    from other files than its partition (i.e. the files of 'main.py sync').
+    '''
+    import pandas as pd
+    from storage import write_csv_atomic
+    from tokens import get_decimals
+
+    columns = ['deployment', 'lending_token', 'symbol', 'active_loans', 'active_principal']
+    frames = []
+
+    for deployment in deployments:
+        files = (paths or {}).get(deployment['name']) or shard_paths(deployment['name'], data_dir)
+        if not os.path.isfile(files['active']):
+            continue
+
+        active = pd.read_csv(files['active'], index_col='id',
+                             dtype={'principal': float, 'collateral': float})
+        if active.empty:
+            continue
+
+        registry = {}
+        if os.path.isfile(files['registry']):
+            with open(files['registry'], 'r') as file:
+                registry = json.load(file)
+
+        # Apply decimals of each lending token
+        scale = active['address_lending_token'].map(
+            lambda token: 10 ** get_decimals(token, registry))
+        active['principal'] = active['principal'] / scale
+
+        grouped = active.groupby('address_lending_token')['principal'] \
+            .agg(['count', 'sum']).reset_index()
+        grouped.columns = ['lending_token', 'active_loans', 'active_principal']
+        grouped.insert(0, 'deployment', deployment['name'])
+        grouped.insert(2, 'symbol', grouped['lending_token'].map(
+            lambda token: registry.get(token, {}).get('symbol')
+            or token_map.get(token, {}).get('symbol', token)))
+        frames.append(grouped)
+
+    metrics = pd.concat(frames, ignore_index=True) if frames \
+        else pd.DataFrame(columns=columns)
+
+    rows = ([str(v) for v in row] for row in metrics[columns].itertuples(index=False))
+    write_csv_atomic(fileName, columns, rows)
+
+    return metrics
+
+
+if __name__ == '__main__':
+    deployments = load_deployments(*sys.argv[1:2])
+    run_all(deployments)
+    print(aggregate_metrics(deployments))
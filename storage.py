@@ -0,0 +1,453 @@
+#############################################################################
+#    Helpers to maintain the csv files written by appendToCsv() without
+#    rebuilding them. Files are replaced atomically (temp file + rename),
+#    so anyone reading them never sees a missing or half-written file.
+#############################################################################
+
+import os, json, mmap, gzip
+from datetime import datetime
+
+
+# Helper function: Current time in the format used for the 'time' column
+def now_str():
+    return datetime.now().strftime('%Y %b %d %H:%M')
+
+
+# Writes header + rows to a temp file next to fileName, then renames it
+def write_csv_atomic(fileName, header, rows):
+    '''
+    header: list of column names. rows: iterable of lists of str values.
+    Same format as appendToCsv(): No newline after the last row.
+    '''
+    tmp_name = os.path.join(os.path.dirname(os.path.abspath(fileName)),
+                            '.' + os.path.basename(fileName) + '.tmp')
+
+    with open(tmp_name, 'w') as file:
+        file.write(','.join(header))
+        for row in rows:
+            file.write('\n' + ','.join(row))
+        file.flush()
+        os.fsync(file.fileno())
+
+    os.replace(tmp_name, fileName)
+
+
+# Reads a csv written by appendToCsv() into a table keyed by column key
+def read_keyed_csv(fileName, key='loan_address'):
+    '''
+    Returns (header, table) with table = {key value: row as list of str}.
+    Rows keep their file order. Returns (None, {}) if there's no file.
+    '''
+    if not os.path.isfile(fileName):
+        return None, {}
+
+    with open(fileName, 'r') as file:
+        lines = file.read().split('\n')
+
+    header = lines[0].strip().split(',')
+    i_key = header.index(key)
+    table = {}
+
+    for line in lines[1:]:
+        if line.strip():
+            row = line.strip().split(',')
+            table[row[i_key]] = row
+
+    return header, table
+
+
+# Brings a keyed csv in line with new_rows, only touching rows that changed
+def apply_delta(fileName, new_rows, varNames, key='loan_address'):
+    '''
+    new_rows: {key value: list of values ordered as varNames}, i.e. all loans
+    that should be in the file. Rows not in new_rows are removed, new ones
+    are inserted and rows with changed values are updated (with a new 'time').
+    Unchanged rows are kept as they are. File is only rewritten on changes.
+    Format of header:    id,time,key,[varNames]
+    Returns dict with the keys that were 'inserted', 'updated', 'removed'.
+    '''
+    header = ['id', 'time', key] + list(varNames)
+    old_header, table = read_keyed_csv(fileName, key=key)
+
+    # Possibility: Columns changed (or no file yet). Every row counts as new.
+    if old_header != header:
+        table = {}
+
+    delta = {'inserted': [], 'updated': [], 'removed': []}
+    parsedTime = now_str()
+
+    for k in list(table):
+        if k not in new_rows:
+            del table[k]
+            delta['removed'].append(k)
+
+    for k, values in new_rows.items():
+        values = [str(v) for v in values]
+        if k not in table:
+            table[k] = ['', parsedTime, k] + values
+            delta['inserted'].append(k)
+        elif table[k][3:] != values:
+            table[k] = ['', parsedTime, k] + values
+            delta['updated'].append(k)
+
+    # Publish changes atomically. Successive ids in file order.
+    if any(delta.values()) or old_header != header:
+        rows = ([str(i)] + row[1:] for i, row in enumerate(table.values()))
+        write_csv_atomic(fileName, header, rows)
+
+    return delta
+
+
+#############################################################################
+#
+# Sidecar index (<fileName>.idx) for csv files written by appendToCsv()
+#   header      list of column names
+#   n_rows      number of data rows (without header)
+#   last_id     id of the last row
+#   latest      {key value: byte offset of its latest row}
+#   size        number of bytes covered by the index
+#   Size of the index grows with the number of loans, not with the rows.
+#
+#############################################################################
+
+# INDEXES <- in-memory copies of sidecar indexes {fileName: index}
+INDEXES = {}
+
+
+# Helper function: Returns path of the sidecar index of a csv file
+def index_path(fileName):
+    return fileName + '.idx'
+
+
+# Helper function: Index of a file with no rows indexed yet
+def empty_index(key):
+    return {'header': None, 'key': key, 'n_rows': 0, 'last_id': None,
+            'size': 0, 'mtime_ns': None, 'tail': '', 'latest': {}}
+
+
+# Helper function for get_index(): Reads sidecar index from disk if there is one
+def load_index_file(fileName, key):
+    try:
+        with open(index_path(fileName), 'r') as file:
+            index = json.load(file)
+    except (OSError, ValueError):
+        return empty_index(key)
+
+    # Possibility: Other key or older index format. Re-index from scratch.
+    if index.get('key') != key or 'latest' not in index:
+        return empty_index(key)
+    return index
+
+
+# Helper function: Returns the header of a mmapped csv as list of column names
+def read_header(mm):
+    nl = mm.find(b'\n')
+    return mm[:nl if nl != -1 else len(mm)].decode().strip().split(',')
+
+
+# Helper function for get_index(): Indexes rows in mm that aren't indexed yet
+def scan_rows(index, mm):
+    '''Only reads the bytes appended since index['size'].'''
+    end = len(mm)
+    start = index['size']
+
+    # Possibility: Nothing indexed yet. Read header first.
+    if start == 0:
+        index['header'] = read_header(mm)
+        nl = mm.find(b'\n')
+        pos = nl if nl != -1 else end
+    # Possibility: Last indexed row ended with a newline (i.e. written by pandas)
+    elif mm[start - 1:start] == b'\n':
+        pos = start - 1
+    else:
+        pos = start
+
+    key = index['key']
+    i_key = index['header'].index(key) if key in index['header'] else None
+
+    # pos always points at the newline in front of the next row
+    while pos < end:
+        row_start = pos + 1
+        nl = mm.find(b'\n', row_start)
+        row_end = nl if nl != -1 else end
+        fields = mm[row_start:row_end].strip().split(b',')
+
+        if fields != [b'']:
+            index['n_rows'] += 1
+            try:
+                index['last_id'] = int(fields[0])
+            except ValueError:
+                pass
+            if i_key is not None and i_key < len(fields):
+                index['latest'][fields[i_key].decode()] = row_start
+
+        pos = row_end
+
+    index['size'] = end
+    index['tail'] = mm[max(0, end - 32):end].hex()
+
+
+# Returns up to date index of a csv file. Only new bytes are read.
+def get_index(fileName, key='loan_address'):
+    '''
+    Returns index dict (see above) of fileName, None if there's no file.
+    Rows appended since the index was last updated are scanned from the
+    file tail. The whole file is only re-indexed if it has been rewritten.
+    '''
+    if not os.path.isfile(fileName):
+        INDEXES.pop(fileName, None)
+        return None
+
+    stat = os.stat(fileName)
+    index = INDEXES.get(fileName)
+
+    # Possibility: In-memory index still matches the file
+    if index and index['key'] == key and index['size'] == stat.st_size \
+            and index['mtime_ns'] == stat.st_mtime_ns:
+        return index
+
+    if not index or index['key'] != key:
+        index = load_index_file(fileName, key)
+
+    if stat.st_size == 0:
+        index = empty_index(key)
+    else:
+        with open(fileName, 'rb') as file, \
+                mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            size = index['size']
+
+            # Possibility: File has been rewritten since. Re-index from scratch.
+            if size > len(mm) or mm[max(0, size - 32):size].hex() != index['tail'] \
+                    or (size and read_header(mm) != index['header']):
+                index = empty_index(key)
+
+            scan_rows(index, mm)
+
+    index['mtime_ns'] = stat.st_mtime_ns
+    INDEXES[fileName] = index
+    return index
+
+
+# Writes the in-memory index of fileName to its sidecar file
+def save_index(fileName):
+    if fileName not in INDEXES:
+        return
+
+    tmp_name = index_path(fileName) + '.tmp'
+    with open(tmp_name, 'w') as file:
+        json.dump(INDEXES[fileName], file)
+    os.replace(tmp_name, index_path(fileName))
+
+
+# Helper function: Reads the rows starting at the given byte offsets (mmap)
+def read_rows_at(fileName, offsets):
+    '''Returns a list of rows (lists of str), one per offset.'''
+    if not offsets:
+        return []
+
+    rows = []
+    with open(fileName, 'rb') as file, \
+            mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        for offset in offsets:
+            nl = mm.find(b'\n', offset)
+            row_end = nl if nl != -1 else len(mm)
+            rows.append(mm[offset:row_end].decode().strip().split(','))
+
+    return rows
+
+
+# Returns all rows of a loan in file order
+def read_loan_rows(fileName, loan, key='loan_address'):
+    '''
+    The index only knows a loan's latest row, so this scans the file (mmap)
+    up to that row. Rows of compacted months are in archive_segments().
+    '''
+    index = get_index(fileName, key=key)
+    if not index or loan not in index['latest'] or key not in index['header']:
+        return []
+
+    i_key = index['header'].index(key)
+    last = index['latest'][loan]
+    rows = []
+
+    with open(fileName, 'rb') as file, \
+            mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        pos = mm.find(b'\n')
+
+        # Rows after the latest one can't belong to the loan
+        while pos != -1 and pos < last:
+            row_start = pos + 1
+            pos = mm.find(b'\n', row_start)
+            fields = mm[row_start:pos if pos != -1 else len(mm)].decode().strip().split(',')
+            if i_key < len(fields) and fields[i_key] == loan:
+                rows.append(fields)
+
+    return rows
+
+
+# Returns the most recent row of a loan. None if the loan isn't in the file.
+def read_latest_row(fileName, loan, key='loan_address'):
+    index = get_index(fileName, key=key)
+    if not index or loan not in index['latest']:
+        return None
+    return read_rows_at(fileName, [index['latest'][loan]])[0]
+
+
+# Returns the last n rows of a file (without header), reading from its end
+def read_tail(fileName, n=1):
+    if n <= 0 or not os.path.isfile(fileName) or os.path.getsize(fileName) == 0:
+        return []
+
+    with open(fileName, 'rb') as file, \
+            mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        end = len(mm)
+        rows = []
+
+        # Walk backwards from newline to newline. Stop at the header.
+        while len(rows) < n:
+            nl = mm.rfind(b'\n', 0, end)
+            if nl == -1:
+                break
+            line = mm[nl + 1:end].strip()
+            if line:
+                rows.append(line.decode().split(','))
+            end = nl
+
+    return rows[::-1]
+
+
+#############################################################################
+#
+# Compaction of the append-only loan history
+#   <name>_latest.csv               latest row per loan (snapshot)
+#   <archive_dir>/<name>_YYYY-MM.csv.gz   rows of past months (by 'time')
+#   <name>.csv                      rows of the current month only
+#
+#############################################################################
+
+archive_dir = 'archive'
+
+
+# Helper function: Path of the latest-state snapshot of a history file
+def snapshot_path(fileName):
+    base, ext = os.path.splitext(fileName)
+    return base + '_latest' + ext
+
+
+# Helper function: Path of the compressed archive segment of a month ('2021-02')
+def archive_path(fileName, month, archive_dir=archive_dir):
+    base = os.path.splitext(os.path.basename(fileName))[0]
+    folder = os.path.join(os.path.dirname(fileName), archive_dir)
+    return os.path.join(folder, f'{base}_{month}.csv.gz')
+
+
+# Returns paths of all archive segments of a history file, oldest first
+def archive_segments(fileName, archive_dir=archive_dir):
+    base = os.path.splitext(os.path.basename(fileName))[0]
+    folder = os.path.join(os.path.dirname(fileName), archive_dir)
+    if not os.path.isdir(folder):
+        return []
+    return sorted(os.path.join(folder, name) for name in os.listdir(folder)
+                  if name.startswith(base + '_') and name.endswith('.csv.gz'))
+
+
+# Helper function: Month ('2021-02') of a value of the 'time' column
+def month_of(parsedTime):
+    return datetime.strptime(parsedTime, '%Y %b %d %H:%M').strftime('%Y-%m')
+
+
+# Helper function: Reads header and rows (lists of str) of a csv or csv.gz
+def read_rows(fileName):
+    opener = gzip.open if fileName.endswith('.gz') else open
+    with opener(fileName, 'rt') as file:
+        lines = (line.strip() for line in file)
+        header = next(lines, '').split(',')
+        rows = [line.split(',') for line in lines if line]
+    return header, rows
+
+
+# Returns the id of the last row ever appended to a (possibly compacted) history file
+def get_last_id(fileName, key='loan_address'):
+    '''
+    Last id of fileName. If compaction left no rows in fileName, the last id
+    is the highest id in its snapshot (snapshot rows are ordered by id).
+    '''
+    for name in (fileName, snapshot_path(fileName)):
+        index = get_index(name, key=key)
+        if index and index['last_id'] is not None:
+            return index['last_id']
+    return None
+
+
+# Folds the history file into snapshot + monthly archive segments
+def compact_history(fileName, key='loan_address', archive_dir=archive_dir, month=None):
+    '''
+    Moves all rows of months before month (default: current month) to
+    gzipped archive segments, folds them into the latest-state snapshot and
+    keeps only the rows of month in fileName. Safe to rerun after a crash:
+    Segments and snapshot are deduplicated by id, every file is replaced
+    atomically. Returns dict {month: #rows archived}.
+    '''
+    if not os.path.isfile(fileName):
+        return {}
+
+    month = month or datetime.now().strftime('%Y-%m')
+    header, rows = read_rows(fileName)
+    i_key, i_time = header.index(key), header.index('time')
+
+    # Split rows into current segment and rows to archive (per month)
+    current, to_archive = [], {}
+    for row in rows:
+        row_month = month_of(row[i_time])
+        if row_month < month:
+            to_archive.setdefault(row_month, []).append(row)
+        else:
+            current.append(row)
+
+    # Write archive segments. Merge with existing segment of the same month.
+    for row_month, new_rows in to_archive.items():
+        path = archive_path(fileName, row_month, archive_dir)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        merged = {}
+        if os.path.isfile(path):
+            merged = {row[0]: row for row in read_rows(path)[1]}
+        merged.update({row[0]: row for row in new_rows})
+
+        tmp_name = path + '.tmp'
+        with gzip.open(tmp_name, 'wt') as file:
+            file.write(','.join(header))
+            for row in sorted(merged.values(), key=lambda row: int(row[0])):
+                file.write('\n' + ','.join(row))
+        os.replace(tmp_name, path)
+
+    # Fold archived rows into snapshot: Latest row (highest id) per loan
+    snapshot = snapshot_path(fileName)
+    latest = {}
+    if os.path.isfile(snapshot):
+        latest = {row[i_key]: row for row in read_rows(snapshot)[1]}
+    for row_month in sorted(to_archive):
+        for row in to_archive[row_month]:
+            if row[i_key] not in latest or int(row[0]) > int(latest[row[i_key]][0]):
+                latest[row[i_key]] = row
+
+    write_csv_atomic(snapshot, header,
+                     sorted(latest.values(), key=lambda row: int(row[0])))
+    write_csv_atomic(fileName, header, current)
+
+    # Re-index the rewritten files
+    for name in (snapshot, fileName):
+        get_index(name, key=key)
+        save_index(name)
+
+    return {row_month: len(new_rows) for row_month, new_rows in sorted(to_archive.items())}
+
+
+if __name__ == '__main__':
+    # Usage: python storage.py [path/to/yield_hist_loan_activity.csv]
+    import sys
+    fileName = sys.argv[1] if len(sys.argv) > 1 else 'yield_hist_loan_activity.csv'
+    archived = compact_history(fileName)
+    for row_month, n_rows in archived.items():
+        print(f'{row_month}: {n_rows} row(s) archived.')
+    print(f'Compacted {fileName}. Snapshot: {snapshot_path(fileName)}')
@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#############################################################################
+#    Collateral stress test of all active loans.
+#    Active loans are loaded into arrays once (decimals applied), then a
+#    matrix of per-token price shocks (scenarios x tokens) is applied to all
+#    loans at once through NumPy broadcasting. Reports how many loans would
+#    be under-collateralized and the principal at risk per scenario & token.
+#
+#    Usage:  python stress.py [n_scenarios] [volatility]
+#############################################################################
+
+import sys
+from time import time
+
+import numpy as np
+
+from lookups import token_map
+from storage import read_keyed_csv
+from tokens import load_token_registry, get_decimals
+from prices import load_price_store, price_asof
+
+
+csv_active_loans = 'yield_active_loans.csv'
+
+
+# Loads all active loans into arrays
+def load_active_loans(fileName=csv_active_loans):
+    '''
+    Returns dict of arrays (one entry per loan):
+    loans, tokens           loan addresses, all tokens used (lending or collateral)
+    lend, coll              index into tokens of lending / collateral token
+    principal, interest,
+    collateral              amounts in whole tokens (decimals applied)
+    ts_due                  unix timestamp the loan is due
+    '''
+    header, table = read_keyed_csv(fileName)
+    rows = list(table.values())
+    columns = {name: [row[i] for row in rows] for i, name in enumerate(header or [])}
+
+    lend_tokens = columns.get('address_lending_token', [])
+    coll_tokens = columns.get('address_collateral_token', [])
+    tokens = sorted(set(lend_tokens) | set(coll_tokens))
+    i_token = {token: i for i, token in enumerate(tokens)}
+
+    load_token_registry()
+    scale = np.array([10.0 ** get_decimals(token) for token in tokens])
+    lend = np.array([i_token[t] for t in lend_tokens], dtype='int64')
+    coll = np.array([i_token[t] for t in coll_tokens], dtype='int64')
+
+    # uint256 amounts don't fit int64. Parse as int first, then apply decimals.
+    def amounts(name, index):
+        raw = np.array([float(int(v)) for v in columns.get(name, [])])
+        return raw / scale[index] if len(raw) else raw
+
+    return {
+        'loans': list(table),
+        'tokens': tokens,
+        'lend': lend,
+        'coll': coll,
+        'principal': amounts('principal', lend),
+        'interest': amounts('interest', lend),
+        'collateral': amounts('collateral', coll),
+        'ts_due': np.array([int(v) for v in columns.get('ts_due', [])], dtype='int64')
+        }
+
+
+# Current USD price of each token as stored in the price store
+def current_prices(tokens, store=None, ts=None):
+    '''Returns array of USD prices in the order of tokens. NaN if unknown.'''
+    store = store if store is not None else load_price_store()
+    assets = [token_map.get(token, {}).get('coingecko_str', '') for token in tokens]
+    return price_asof(store, assets, np.full(len(tokens), int(ts or time())))
+
+
+# Scenario generator: Independent lognormal price moves per token
+def random_shocks(n_scenarios, n_tokens, volatility=0.3, seed=None):
+    '''Returns (n_scenarios x n_tokens) matrix of price factors (1 = unchanged).'''
+    rng = np.random.default_rng(seed)
+    return np.exp(rng.normal(-volatility**2 / 2, volatility, (n_scenarios, n_tokens)))
+
+
+# Scenario generator: All tokens move by the same factor, one scenario per level
+def uniform_shocks(levels, n_tokens):
+    '''i.e. levels = np.linspace(0.1, 1, 10) for drops of 90% ... 0%.'''
+    return np.repeat(np.asarray(levels, dtype='float64')[:, None], n_tokens, axis=1)
+
+
+# Applies all scenarios to all loans at once
+def stress_test(loans, prices, shocks, min_ratio=1.0, include_interest=True, due_before=None):
+    '''
+    loans:      dict returned by load_active_loans()
+    prices:     array of USD prices per token (same order as loans['tokens'])
+    shocks:     (scenarios x tokens) matrix of price factors
+    min_ratio:  loan is at risk if collateral value < min_ratio * debt value
+    due_before: only consider loans due before this unix timestamp
+    Returns dict of arrays:
+    at_risk             (scenarios x loans) bool
+    n_at_risk           (scenarios,) number of loans at risk
+    principal_at_risk   (scenarios x tokens) USD principal at risk per lending token
+                        (valued at unshocked prices)
+    '''
+    shocks = np.atleast_2d(shocks)
+    prices = np.asarray(prices, dtype='float64')
+    lend, coll = loans['lend'], loans['coll']
+
+    debt = loans['principal'] + (loans['interest'] if include_interest else 0)
+
+    # (scenarios x loans): Shocked USD value of debt and collateral
+    debt_usd = shocks[:, lend] * (debt * prices[lend])
+    coll_usd = shocks[:, coll] * (loans['collateral'] * prices[coll])
+
+    # NaN prices compare as False, so loans without prices never count as at risk
+    at_risk = coll_usd < min_ratio * debt_usd
+    if due_before is not None:
+        at_risk &= loans['ts_due'] < due_before
+
+    # Sum principal at risk per lending token: (scenarios x loans) @ (loans x tokens)
+    principal_usd = np.nan_to_num(loans['principal'] * prices[lend])
+    one_hot = np.zeros((len(lend), len(loans['tokens'])))
+    one_hot[np.arange(len(lend)), lend] = 1
+
+    return {
+        'at_risk': at_risk,
+        'n_at_risk': at_risk.sum(axis=1),
+        'principal_at_risk': (at_risk * principal_usd) @ one_hot
+        }
+
+
+if __name__ == '__main__':
+    n_scenarios = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    volatility = float(sys.argv[2]) if len(sys.argv) > 2 else 0.3
+
+    loans = load_active_loans()
+    prices = current_prices(loans['tokens'])
+    shocks = random_shocks(n_scenarios, len(loans['tokens']), volatility)
+
+    start = time()
+    result = stress_test(loans, prices, shocks)
+    seconds = time() - start
+
+    print(f"{len(loans['loans'])} active loans, {n_scenarios} scenarios "
+          f"(volatility {volatility}) in {seconds:.3f} s.")
+    print(f"Loans at risk: mean {result['n_at_risk'].mean():.1f}, "
+          f"max {result['n_at_risk'].max(initial=0)}")
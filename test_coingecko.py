@@ -0,0 +1,37 @@
+#############################################################################
+#    Checks the coingecko extraction against the saved pages in fixtures/.
+#
+#    Usage:  python -m pytest -q test_coingecko.py
+#############################################################################
+
+import math
+
+from coingecko import fixture_dir, validate_fixtures, extract_token_metrics, \
+    extract_token_price
+
+
+# Helper function: Raw html of a saved coin page
+def read_fixture(token_str):
+    with open(f'{fixture_dir}/{token_str}.html', 'rb') as file:
+        return file.read()
+
+
+def test_no_failed_fields():
+    results = validate_fixtures(verbose=False)
+    assert results, f'No fixture pages found in {fixture_dir}.'
+    assert {name: field for name, field in results.items() if field is not None} == {}
+
+
+def test_extracted_values():
+    metrics = extract_token_metrics(read_fixture('chainlink'))
+    assert metrics['symbol'] == 'link'
+    assert metrics['priceUSD'] == extract_token_price(read_fixture('chainlink')) == 28.17
+    assert metrics['mcRank'] == 10
+    assert metrics['totalSupply'] == 1e9
+
+    # Infinite supply (ETH) becomes inf
+    assert math.isinf(extract_token_metrics(read_fixture('ethereum'))['totalSupply'])
+
+
+def test_missing_fixture_dir(tmp_path):
+    assert validate_fixtures(str(tmp_path / 'missing'), verbose=False) == {}
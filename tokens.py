@@ -0,0 +1,184 @@
+#############################################################################
+#    Token registry for all ERC20 tokens used on yield.credit.
+#    Builds on token_map and resolves decimals, symbol and totalSupply for
+#    all tokens in one batched eth_call (Multicall2). Immutable fields are
+#    persisted to a json file, only the supply is refreshed on a schedule.
+#############################################################################
+
+import os, json
+import time
+
+from lookups import token_map, ERC20_ABI, MULTICALL_ABI, multicall_address
+
+
+# Specify path to registry file. File will be created if not found.
+registry_file = 'yield_token_registry.json'
+
+# Refresh a token's totalSupply() once its stored value is older than this (s)
+SUPPLY_MAX_AGE = 24 * 3600
+
+# Max number of calls bundled into a single tryAggregate() call
+BATCH_SIZE = 300
+
+# TOKEN_REGISTRY <- {token_address: {'symbol', 'decimals', 'total_supply', 'ts_supply'}}
+TOKEN_REGISTRY = {}
+
+
+# Reads persisted registry into TOKEN_REGISTRY. Empty registry if no file yet.
+def load_token_registry(path=None):
+    '''Loads token registry from json file (default: registry_file) and returns it.'''
+    path = path or registry_file
+
+    # Update in place, so modules holding a reference see the loaded data
+    TOKEN_REGISTRY.clear()
+
+    if os.path.isfile(path):
+        with open(path, 'r') as file:
+            TOKEN_REGISTRY.update(json.load(file))
+
+    return TOKEN_REGISTRY
+
+
+# Writes TOKEN_REGISTRY to file (temp file + rename, so no half-written file)
+def save_token_registry(path=None):
+    path = path or registry_file
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as file:
+        json.dump(TOKEN_REGISTRY, file, indent=2, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+# Helper function for sync_token_registry(): Runs many ERC20 calls in one eth_call
+def batch_call(w3, requests, block_identifier='latest', multicall=multicall_address):
+    '''
+    Takes a list of (token_address, fn_name) tuples, i.e. (LINK, 'decimals').
+    Returns a list of decoded values in the same order. None for failed calls.
+    multicall: address of Multicall2 on the connected network. None if there
+    is none, then every call is a separate eth_call.
+    '''
+    erc20 = w3.eth.contract(abi=ERC20_ABI)
+    results = []
+
+    # Possibility: No Multicall2 on this network. Query tokens one by one.
+    if not multicall:
+        for address, fn in requests:
+            try:
+                data = w3.eth.call({'to': address, 'data': erc20.encodeABI(fn_name=fn)},
+                                   block_identifier)
+                results.append(decode_return(w3, fn, data))
+            except Exception:
+                results.append(None)
+        return results
+
+    multicall = w3.eth.contract(address=multicall, abi=MULTICALL_ABI)
+
+    for i in range(0, len(requests), BATCH_SIZE):
+        batch = requests[i:i + BATCH_SIZE]
+        calls = [(address, w3.toBytes(hexstr=erc20.encodeABI(fn_name=fn)))
+                 for address, fn in batch]
+        returned = multicall.functions.tryAggregate(False, calls) \
+            .call(block_identifier=block_identifier)
+
+        for (address, fn), (success, data) in zip(batch, returned):
+            results.append(decode_return(w3, fn, data) if success else None)
+
+    return results
+
+
+# Helper function for batch_call(): Decodes raw return data of an ERC20 call
+def decode_return(w3, fn_name, data):
+    if not data:
+        return None
+
+    if fn_name == 'symbol':
+        try:
+            return w3.codec.decode_abi(['string'], data)[0]
+        # Some older tokens (i.e. MKR) return bytes32 instead of string
+        except Exception:
+            return data[:32].rstrip(b'\x00').decode('utf-8', 'ignore')
+
+    try:
+        return w3.codec.decode_abi(['uint256'], data)[0]
+    except Exception:
+        return None
+
+
+# Resolves unknown tokens and refreshes stale supplies in one batched call
+def sync_token_registry(w3, addresses=(), path=None, max_age=SUPPLY_MAX_AGE,
+                        block_identifier='latest', multicall=multicall_address,
+                        mainnet=True):
+    '''
+    Makes sure every token in the registry and in addresses (plus every
+    token in token_map if mainnet) has decimals, symbol and a total supply
+    not older than max_age (s). Everything missing is fetched with a single
+    batched web3 query through the Multicall2 contract at multicall.
+    Returns TOKEN_REGISTRY.
+    '''
+    if not TOKEN_REGISTRY:
+        load_token_registry(path)
+
+    now = int(time.time())
+    tokens = set(TOKEN_REGISTRY) | {w3.toChecksumAddress(address) for address in addresses}
+
+    # token_map holds mainnet addresses. Other networks only resolve their own tokens.
+    if mainnet:
+        tokens |= set(token_map)
+
+    # Immutable fields only for tokens never seen before, supply if outdated
+    requests = []
+    for token in sorted(tokens):
+        entry = TOKEN_REGISTRY.get(token, {})
+        if 'decimals' not in entry:
+            requests += [(token, 'decimals'), (token, 'symbol')]
+        if now - entry.get('ts_supply', 0) > max_age:
+            requests.append((token, 'totalSupply'))
+
+    if not requests:
+        return TOKEN_REGISTRY
+
+    results = batch_call(w3, requests, block_identifier=block_identifier,
+                         multicall=multicall)
+
+    # Store results. Fall back to token_map for immutable fields if call failed.
+    for (token, fn), value in zip(requests, results):
+        entry = TOKEN_REGISTRY.setdefault(token, {})
+        fallback = token_map.get(token, {})
+
+        # Leave decimals unset if unresolvable, so they're retried next time
+        if fn == 'decimals':
+            value = value if value is not None else fallback.get('decimals')
+            if value is not None:
+                entry['decimals'] = value
+        elif fn == 'symbol':
+            entry['symbol'] = value or fallback.get('symbol', token)
+        elif fn == 'totalSupply':
+            entry['total_supply'] = value
+            entry['ts_supply'] = now
+
+    save_token_registry(path)
+    return TOKEN_REGISTRY
+
+
+# Helper function: Returns registry entry for a token. Empty dict if unknown.
+def get_token_info(address):
+    return TOKEN_REGISTRY.get(address, {})
+
+
+# The one decimals lookup: Token registry, else token_map. Raises if unknown.
+def get_decimals(address, registry=None):
+    '''
+    registry: dict in the format of TOKEN_REGISTRY (default: TOKEN_REGISTRY),
+    i.e. the registry of another deployment. 0 decimals are valid decimals.
+    Raises ValueError if the token is in neither of them, as any guess would
+    skew amounts by orders of magnitude.
+    '''
+    registry = registry if registry is not None else TOKEN_REGISTRY
+
+    decimals = registry.get(address, {}).get('decimals')
+    if decimals is None:
+        decimals = token_map.get(address, {}).get('decimals')
+
+    if decimals is None:
+        raise ValueError(f"Couldn't resolve decimals of ERC20 address {address}: "
+                         'not in token registry nor in token_map.')
+    return decimals